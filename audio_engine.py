@@ -0,0 +1,437 @@
+"""
+Audio Engine Module
+实时混音引擎：所有音符在固定大小的声部池中混合成一路音频流，
+通过单个 pygame 声道连续排队播放
+避免每个音符单独 Sound.play() 时 pygame 默认的8个声道被占满而静默丢音
+
+音频输出（sink）可替换：PygameSink 实时播放，NullSink 丢弃，FileSink 写入WAV
+pygame 只在 PygameSink 打开时导入
+"""
+import queue
+import threading
+import time
+import wave
+from collections import deque
+import numpy as np
+
+
+class AudioEngine:
+    def __init__(self, sample_rate=22050, block_size=512, max_voices=64,
+                 max_gain=0.9, max_pending=256):
+        """
+        sample_rate: 采样率（需与 pygame.mixer 初始化一致）
+        block_size: 每次混音的采样数（512 ≈ 23ms）
+        max_voices: 声部池大小，满时偷取最早开始的声部
+        max_gain: 混音输出的峰值上限（0-1），超过时平滑压低增益而不是削波
+        max_pending: 等待进入声部池的音符上限，超过时丢弃
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.max_gain = max_gain
+        self.max_pending = max_pending
+        
+        # 固定声部池：采样、增益、播放位置、开始顺序
+        self.voice_samples = [None] * max_voices
+        self.voice_gain = np.zeros(max_voices, dtype=np.float32)
+        self.voice_position = np.zeros(max_voices, dtype=np.int64)
+        self.voice_order = np.zeros(max_voices, dtype=np.int64)
+        self.active = np.zeros(max_voices, dtype=bool)
+        self._next_order = 0
+        
+        self.pending = deque()
+        self._lock = threading.Lock()
+        self._mix = np.zeros(block_size, dtype=np.float32)
+        self._output_gain = 1.0
+        
+        # 统计
+        self.dropped_voices = 0
+        self.stolen_voices = 0
+        self.limited_blocks = 0
+        self.blocks_mixed = 0
+        
+        self.channel = None
+        self._thread = None
+        self._running = False
+    
+    def start(self):
+        """预留一个 pygame 声道并启动混音线程，失败时返回 False"""
+        if self._running:
+            return True
+        try:
+            import pygame
+            pygame.mixer.set_reserved(1)
+            self.channel = pygame.mixer.Channel(0)
+        except Exception as e:
+            print(f"✗ Audio engine start failed: {e}")
+            return False
+        
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"✓ Audio engine started ({self.max_voices} voices, {self.block_size}-sample blocks)")
+        return True
+    
+    def stop(self):
+        """停止混音线程"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self.channel is not None:
+            try:
+                self.channel.stop()
+            except Exception:
+                pass
+    
+    def play(self, samples, gain=1.0):
+        """
+        播放一个音符
+        samples: int16 采样，(N,) 单声道或 (N, 2) 立体声（只取左声道）
+        gain: 额外增益
+        返回是否被接受（引擎未运行或等待队列已满时丢弃并计数）
+        """
+        with self._lock:
+            if not self._running or len(self.pending) >= self.max_pending:
+                self.dropped_voices += 1
+                return False
+            self.pending.append((samples, gain))
+        return True
+    
+    def stop_all(self):
+        """立即静音所有声部并清空等待队列"""
+        with self._lock:
+            self.pending.clear()
+            self.active[:] = False
+            self.voice_samples = [None] * self.max_voices
+    
+    def stats(self):
+        """返回声部和混音统计"""
+        with self._lock:
+            return {
+                'active_voices': int(self.active.sum()),
+                'pending': len(self.pending),
+                'dropped_voices': self.dropped_voices,
+                'stolen_voices': self.stolen_voices,
+                'limited_blocks': self.limited_blocks,
+                'blocks_mixed': self.blocks_mixed,
+            }
+    
+    def _assign_pending(self):
+        """把等待队列中的音符放入声部池（需持有锁）"""
+        while self.pending:
+            samples, gain = self.pending.popleft()
+            if samples.ndim == 2:
+                samples = samples[:, 0]
+            
+            free = np.flatnonzero(~self.active)
+            if len(free):
+                voice = free[0]
+            else:
+                # 声部已满：偷取最早开始的声部
+                voice = int(np.argmin(self.voice_order))
+                self.stolen_voices += 1
+            
+            self.voice_samples[voice] = samples
+            self.voice_gain[voice] = gain / 32768.0
+            self.voice_position[voice] = 0
+            self.voice_order[voice] = self._next_order
+            self._next_order += 1
+            self.active[voice] = True
+    
+    def mix_block(self):
+        """混合所有活动声部的下一块，返回 (block_size, 2) int16 立体声"""
+        mix = self._mix
+        mix.fill(0)
+        block = self.block_size
+        
+        with self._lock:
+            self._assign_pending()
+            for voice in np.flatnonzero(self.active):
+                samples = self.voice_samples[voice]
+                position = self.voice_position[voice]
+                chunk = samples[position:position + block]
+                mix[:len(chunk)] += chunk * self.voice_gain[voice]
+                position += len(chunk)
+                if position >= len(samples):
+                    self.active[voice] = False
+                    self.voice_samples[voice] = None
+                else:
+                    self.voice_position[voice] = position
+            self.blocks_mixed += 1
+        
+        # 增益上限：峰值超过 max_gain 时压低，在块内线性过渡避免咔哒声
+        peak = float(np.abs(mix).max())
+        target_gain = min(1.0, self.max_gain / peak) if peak > 0 else 1.0
+        if target_gain < 1.0:
+            self.limited_blocks += 1
+        if target_gain < self._output_gain:
+            # 立即压低（使用本块的目标值，保证不超过上限）
+            mix *= target_gain
+        else:
+            # 缓慢恢复
+            target_gain = min(target_gain, self._output_gain + 0.05)
+            mix *= np.linspace(self._output_gain, target_gain, block, dtype=np.float32)
+        self._output_gain = target_gain
+        
+        wave = (mix * 32767).astype(np.int16)
+        return np.column_stack((wave, wave))
+    
+    def _idle(self):
+        """没有活动声部和等待音符时不需要混音"""
+        return not self.pending and not self.active.any()
+    
+    def _run(self):
+        """混音线程：声道的排队位置空出时补上下一块"""
+        import pygame
+        poll_interval = self.block_size / self.sample_rate / 4
+        while self._running:
+            try:
+                if self._idle() or self.channel.get_queue() is not None:
+                    time.sleep(poll_interval)
+                    continue
+                
+                sound = pygame.sndarray.make_sound(self.mix_block())
+                if self.channel.get_busy():
+                    self.channel.queue(sound)
+                else:
+                    self.channel.play(sound)
+            except Exception as e:
+                print(f"✗ Audio engine error: {e}")
+                time.sleep(poll_interval)
+
+
+class PygameSink:
+    """实时播放：pygame mixer + AudioEngine 混音（引擎启动失败时退回每个音符单独 Sound.play()）"""
+    name = 'pygame'
+    
+    def __init__(self, sample_rate=22050):
+        """sample_rate: mixer 采样率（需与音符波形一致）"""
+        self.sample_rate = sample_rate
+        self.engine = None
+        self.opened = False
+    
+    def open(self):
+        """初始化 mixer 并启动混音引擎，失败时返回 False"""
+        try:
+            import pygame
+            pygame.mixer.init(frequency=self.sample_rate, size=-16, channels=2, buffer=512)
+            self.opened = True
+            print("✓ Audio initialized successfully")
+        except Exception as e:
+            print(f"✗ Audio initialization failed: {e}")
+            return False
+        
+        # 实时混音引擎：所有音符混合到一个声道，不受 pygame 默认8声道限制
+        engine = AudioEngine(sample_rate=self.sample_rate)
+        if engine.start():
+            self.engine = engine
+        return True
+    
+    @property
+    def plays_sounds(self):
+        """没有混音引擎时逐个播放 pygame Sound（调用方应复用缓存的 Sound，见 MelodyGenerator.get_cached_sound）"""
+        return self.opened and self.engine is None
+    
+    def play(self, samples, gain=1.0):
+        """播放 int16 立体声采样（没有混音引擎时每次新建 Sound）"""
+        if self.engine is not None:
+            return self.engine.play(samples, gain)
+        import pygame
+        if gain != 1.0:
+            samples = (samples * gain).astype(np.int16)
+        pygame.sndarray.make_sound(samples).play()
+        return True
+    
+    def stop_all(self):
+        """静音所有声部"""
+        if self.engine is not None:
+            self.engine.stop_all()
+        if self.opened:
+            import pygame
+            pygame.mixer.stop()
+    
+    def close(self):
+        """停止混音引擎"""
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+
+
+class NullSink:
+    """丢弃所有音符（无声卡的服务器、批量导出），只计数"""
+    name = 'null'
+    
+    def __init__(self):
+        self.engine = None
+        self.notes_played = 0
+    
+    def open(self):
+        return True
+    
+    def play(self, samples, gain=1.0):
+        self.notes_played += 1
+        return True
+    
+    def stop_all(self):
+        pass
+    
+    def close(self):
+        pass
+
+
+class FileSink:
+    """
+    把播放的音符按顺序首尾相接写入 WAV（16位立体声，不混音、不保留实时间隔）
+    适合在没有声卡的环境下检查实际播放了什么
+    """
+    name = 'file'
+    
+    def __init__(self, file_path, sample_rate=22050):
+        """
+        file_path: 输出 WAV 路径（打开时创建，已存在则覆盖）
+        sample_rate: 音符波形的采样率
+        """
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.engine = None
+        self.notes_played = 0
+        self._writer = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        """创建 WAV 文件，失败时返回 False"""
+        try:
+            writer = wave.open(self.file_path, 'wb')
+            writer.setnchannels(2)
+            writer.setsampwidth(2)
+            writer.setframerate(self.sample_rate)
+        except Exception as e:
+            print(f"✗ Audio file sink failed: {e}")
+            return False
+        self._writer = writer
+        print(f"✓ Audio output: {self.file_path}")
+        return True
+    
+    def play(self, samples, gain=1.0):
+        """追加一个音符的采样"""
+        if samples.ndim == 1:
+            samples = np.column_stack((samples, samples))
+        if gain != 1.0:
+            samples = np.clip(samples * gain, -32768, 32767)
+        with self._lock:
+            if self._writer is None:
+                return False
+            self._writer.writeframes(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+            self.notes_played += 1
+        return True
+    
+    def stop_all(self):
+        pass
+    
+    def close(self):
+        """写完文件头并关闭"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+def make_audio_sink(spec='pygame', sample_rate=22050):
+    """
+    根据配置创建音频输出
+    spec: 'pygame' - 实时播放；'null' 或 None - 丢弃；以 .wav 结尾的路径 - FileSink；
+          也可以直接传入实现了 open / play / stop_all / close 的对象
+    """
+    if spec is None or spec == 'null':
+        return NullSink()
+    if spec == 'pygame':
+        return PygameSink(sample_rate)
+    if isinstance(spec, str):
+        if spec.lower().endswith('.wav'):
+            return FileSink(spec, sample_rate)
+        raise ValueError(f"Unknown audio sink: {spec}")
+    return spec
+
+
+class AudioWorker:
+    """
+    长期运行的音频派发线程
+    调用方把播放任务放入有界队列，由单个工作线程依次执行，不再为每个音符创建线程
+    """
+    DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+    
+    def __init__(self, max_queue=32, drop_policy='drop_oldest'):
+        """
+        max_queue: 队列上限
+        drop_policy: 队列已满时的处理方式
+                     'drop_oldest' - 丢弃最早的等待任务（保持实时性，默认）
+                     'drop_newest' - 丢弃新任务
+                     'block'       - 阻塞调用方直到有空位（背压）
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.drop_policy = drop_policy
+        self.tasks = queue.Queue(maxsize=max_queue)
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, func, *args):
+        """提交任务，返回是否进入队列"""
+        self.submitted += 1
+        task = (func, args)
+        if self.drop_policy == 'block':
+            self.tasks.put(task)
+            return True
+        
+        while True:
+            try:
+                self.tasks.put_nowait(task)
+                return True
+            except queue.Full:
+                if self.drop_policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                try:
+                    self.tasks.get_nowait()
+                    self.tasks.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+    
+    def clear(self):
+        """丢弃所有尚未执行的任务"""
+        while True:
+            try:
+                self.tasks.get_nowait()
+                self.tasks.task_done()
+            except queue.Empty:
+                return
+    
+    def stats(self):
+        """返回任务统计"""
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.tasks.qsize(),
+        }
+    
+    def _run(self):
+        """工作线程：按提交顺序执行任务"""
+        while True:
+            func, args = self.tasks.get()
+            try:
+                func(*args)
+                self.completed += 1
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print(f"✗ Audio worker error: {e}")
+            finally:
+                self.tasks.task_done()
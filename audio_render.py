@@ -0,0 +1,217 @@
+"""
+Audio Render Module
+离线音频渲染：把音符列表一次性向量化渲染为 int16 PCM 并写入 WAV
+动画导出和摄像头录音导出共用同一个渲染器
+"""
+import os
+import shutil
+import tempfile
+import wave
+import numpy as np
+
+
+def notes_to_arrays(notes, note_duration=None):
+    """
+    把音符字典列表转换为 (pitch, duration, velocity) 数组
+    notes: list of {'pitch', 'duration', 'velocity', ...}
+    note_duration: 固定每个音符的时长（秒），None 时使用音符自身的 duration
+    """
+    count = len(notes)
+    pitch = np.fromiter((note['pitch'] for note in notes), dtype=np.float64, count=count)
+    velocity = np.fromiter((note['velocity'] for note in notes), dtype=np.float64, count=count)
+    if note_duration is None:
+        duration = np.fromiter((note['duration'] for note in notes), dtype=np.float64, count=count)
+    else:
+        duration = np.full(count, float(note_duration))
+    return pitch, duration, velocity
+
+
+def _synthesize_chunks(pitch, duration, velocity, sample_rate, volume, chunk_size):
+    """
+    把音符首尾相接后分块合成方波
+    逐块产出 (chunk_start, chunk_end, note, local, samples)：
+    note/local 是每个采样所属的音符序号和在音符内的采样序号，samples 为浮点采样（-1..1 × 音量）
+    """
+    frequency = 440.0 * (2 ** ((pitch - 69) / 12.0))
+    omega = 2 * np.pi * frequency
+    amplitude = (velocity / 127.0) * volume
+    
+    # 每个音符的采样数、起始位置和时间步长（与 linspace 的 step 相同）
+    lengths = (duration * sample_rate).astype(np.int64)
+    starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    step = np.divide(duration, lengths, out=np.zeros_like(duration), where=lengths > 0)
+    
+    total = int(starts[-1])
+    for chunk_start in range(0, total, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, total)
+        
+        # 与本块重叠的音符，以及每个音符在本块内的采样数
+        first = np.searchsorted(starts, chunk_start, side='right') - 1
+        last = np.searchsorted(starts, chunk_end - 1, side='right') - 1
+        note_starts = starts[first:last + 2]
+        counts = np.minimum(note_starts[1:], chunk_end) - np.maximum(note_starts[:-1], chunk_start)
+        
+        # 音符内的采样序号 → 时间
+        note = np.repeat(np.arange(first, last + 1), counts)
+        local = np.arange(chunk_start, chunk_end) - starts[note]
+        t = local * step[note]
+        
+        samples = np.sign(np.sin(omega[note] * t))
+        samples *= amplitude[note]
+        yield chunk_start, chunk_end, note, local, samples
+
+
+def render_notes(notes, sample_rate=44100, volume=0.3, note_duration=None, chunk_size=1 << 20):
+    """
+    把音符依次首尾相接渲染为8-bit方波，返回 int16 单声道数组
+    notes: list of {'pitch', 'duration', 'velocity', ...}
+    sample_rate: 采样率
+    volume: 最大音量（velocity=127 时）
+    note_duration: 固定每个音符的时长（秒），None 时使用音符自身的 duration
+    chunk_size: 每次向量化计算的采样数（限制浮点中间数组的内存）
+    
+    每个音符的采样与逐个 np.linspace(0, duration, n, False) 生成的结果相同
+    """
+    pitch, duration, velocity = notes_to_arrays(notes, note_duration)
+    total = int((duration * sample_rate).astype(np.int64).sum())
+    output = np.empty(total, dtype=np.int16)
+    
+    for chunk_start, chunk_end, _, _, samples in _synthesize_chunks(
+            pitch, duration, velocity, sample_rate, volume, chunk_size):
+        output[chunk_start:chunk_end] = samples * 32767
+    
+    return output
+
+
+def render_timed_notes(notes, start_times, sample_rate=44100, volume=0.3, total_duration=None,
+                       chunk_size=1 << 20):
+    """
+    按给定的开始时间渲染音符（可以互相重叠，重叠部分混合），返回 int16 单声道数组
+    notes: list of {'pitch', 'duration', 'velocity', ...}
+    start_times: 每个音符的开始时间（秒）
+    total_duration: 输出时长（秒），None 时到最后一个音符结束
+    
+    混合后峰值超过满幅时整体按比例压低，避免削波
+    """
+    pitch, duration, velocity = notes_to_arrays(notes)
+    offsets = np.round(np.asarray(start_times, dtype=np.float64) * sample_rate).astype(np.int64)
+    ends = offsets + (duration * sample_rate).astype(np.int64)
+    
+    if total_duration is None:
+        total = int(ends.max()) if len(ends) else 0
+    else:
+        total = int(round(total_duration * sample_rate))
+    mix = np.zeros(total, dtype=np.float64)
+    
+    for _, _, note, local, samples in _synthesize_chunks(
+            pitch, duration, velocity, sample_rate, volume, chunk_size):
+        # 把本块采样按各自的输出位置累加（bincount 在重叠处求和）
+        position = offsets[note] + local
+        keep = position < total
+        position, samples = position[keep], samples[keep]
+        if len(position) == 0:
+            continue
+        low = int(position.min())
+        summed = np.bincount(position - low, weights=samples)
+        mix[low:low + len(summed)] += summed
+    
+    peak = float(np.abs(mix).max()) if total else 0.0
+    if peak > 1.0:
+        mix /= peak
+    return (mix * 32767).astype(np.int16)
+
+
+def write_wav(file_path, samples, sample_rate=44100, channels=1):
+    """把 int16 采样一次性写入WAV文件"""
+    with wave.open(file_path, 'w') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)  # 16-bit
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+    return file_path
+
+
+class WavStreamWriter:
+    """
+    流式WAV写入：音符边产生边分块渲染并追加到临时WAV文件
+    wave 模块每次写入后都会回写文件头，临时文件随时是完整的WAV，
+    保存时只需复制文件；内存占用与录制时长无关
+    """
+    def __init__(self, sample_rate=44100, note_duration=None, volume=0.3, flush_notes=32):
+        """
+        sample_rate: 采样率
+        note_duration: 固定每个音符的时长（秒），None 时使用音符自身的 duration
+        volume: 最大音量
+        flush_notes: 累积多少个音符渲染并写入一次
+        """
+        self.sample_rate = sample_rate
+        self.note_duration = note_duration
+        self.volume = volume
+        self.flush_notes = flush_notes
+        self.path = None
+        self._file = None
+        self._wav = None
+        self._open()
+    
+    def _open(self):
+        """创建新的临时WAV文件"""
+        fd, self.path = tempfile.mkstemp(prefix='image2melody_', suffix='.wav')
+        self._file = os.fdopen(fd, 'wb')
+        self._wav = wave.open(self._file, 'wb')
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)  # 16-bit
+        self._wav.setframerate(self.sample_rate)
+        self.pending = []
+        self.note_count = 0
+        self.frames_written = 0
+    
+    def add_note(self, note):
+        """追加一个音符（dict，包含 pitch / velocity / duration）"""
+        self.pending.append(note)
+        self.note_count += 1
+        if len(self.pending) >= self.flush_notes:
+            self.flush()
+    
+    def flush(self):
+        """渲染并写入所有等待中的音符"""
+        if self._wav is None or not self.pending:
+            return
+        samples = render_notes(self.pending, self.sample_rate, self.volume, self.note_duration)
+        self._wav.writeframes(samples.astype('<i2', copy=False).tobytes())
+        self.frames_written += len(samples)
+        self.pending = []
+    
+    @property
+    def duration(self):
+        """已写入的音频时长（秒）"""
+        return self.frames_written / self.sample_rate
+    
+    def save_as(self, file_path):
+        """写入剩余音符并把当前WAV复制到目标路径"""
+        self.flush()
+        self._file.flush()
+        shutil.copyfile(self.path, file_path)
+        return file_path
+    
+    def reset(self):
+        """丢弃已录制的内容，重新开始"""
+        self.close()
+        self._open()
+    
+    def close(self):
+        """关闭并删除临时文件"""
+        if self._wav is not None:
+            try:
+                self._wav.close()
+                self._file.close()
+            except Exception:
+                pass
+            self._wav = None
+            self._file = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.path = None
@@ -0,0 +1,305 @@
+"""
+Image2Melody Batch Converter
+多进程批量转换：图片（或整个目录）→ MIDI
+每个工作进程只创建一次 ImageProcessor / MelodyGenerator（音符查找表以 mmap 共享），
+图片按块（chunksize）分发，单张图片超时或出错只记为失败，不影响其他图片
+
+用法:
+    python -m batch_converter photos/ -o midi/               # 使用全部CPU核心
+    python -m batch_converter photos/ -o midi/ -j 8 --chunksize 4 --timeout 30
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from image_processor import ImageProcessor, BLOCK_MODES
+from melody_generator import MelodyGenerator
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tif', '.tiff')
+
+# 'columns' - 每列一个和弦（extract_rgb_by_columns + generate_melody_from_columns）
+# 'pixels'  - 像素块均匀采样为单音旋律（extract_rgb_from_pixelated + generate_melody）
+BATCH_MODES = ('columns', 'pixels')
+
+
+class ItemTimeout(Exception):
+    """单张图片的处理超过了 --timeout"""
+
+
+def find_images(paths, output_dir=None):
+    """
+    展开输入路径（文件或目录，目录递归查找图片）
+    返回 [(图片路径, MIDI输出路径), ...]
+    output_dir 为 None 时 MIDI 写在图片旁边，否则在 output_dir 下保留相对目录结构
+    """
+    items = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        image_path = os.path.join(root, name)
+                        found.append((image_path, os.path.relpath(image_path, path)))
+        else:
+            found = [(path, os.path.basename(path))]
+        
+        for image_path, relative in found:
+            stem = os.path.splitext(relative)[0] + '.mid'
+            if output_dir:
+                output_path = os.path.join(output_dir, stem)
+            else:
+                output_path = os.path.splitext(image_path)[0] + '.mid'
+            items.append((image_path, output_path))
+    return items
+
+
+def convert_image(image_path, output_path, processor, generator, mode='columns', octave_shift=0,
+                  max_notes=64):
+    """
+    转换一张图片并保存 MIDI，返回音符数
+    octave_shift: 音高偏移（半音，仅 columns 模式）
+    max_notes: pixels 模式下最多采样的音符数
+    """
+    if mode == 'columns':
+        grid, _, _ = processor.extract_rgb_by_columns(image_path, as_array=True)
+        notes, _ = generator.generate_melody_from_columns(grid, octave_shift)
+    elif mode == 'pixels':
+        grid, _ = processor.extract_rgb_from_pixelated(image_path, as_array=True)
+        notes, _ = generator.generate_melody(grid.reshape(-1, 4), max_notes)
+    else:
+        raise ValueError(f"Unknown batch mode: {mode}")
+    
+    if not notes:
+        raise ValueError("No blocks extracted")
+    
+    output_parent = os.path.dirname(output_path)
+    if output_parent:
+        os.makedirs(output_parent, exist_ok=True)
+    
+    # 先写临时文件再原子替换：超时或出错时不会留下不完整的 MIDI
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        generator.save_midi(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(notes)
+
+
+# 工作进程的状态（_init_worker 创建，同一进程内的所有图片复用）
+_worker = None
+
+
+def _raise_timeout(signum, frame):
+    raise ItemTimeout()
+
+
+def _init_worker(settings, ignore_interrupt=True):
+    """
+    工作进程初始化：创建处理器和生成器，注册超时信号
+    ignore_interrupt: 忽略 Ctrl+C（由主进程统一处理并关闭进程池）
+    """
+    global _worker
+    if ignore_interrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if settings['timeout'] and hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+    
+    generator = MelodyGenerator(audio_sink='null')
+    if settings['note_lut']:
+        generator.enable_note_lut()
+    
+    _worker = {
+        'processor': ImageProcessor(pixel_size=settings['pixel_size'], reduced_decode=settings['reduced_decode'],
+                                    block_mode=settings['block_mode']),
+        'generator': generator,
+        'settings': settings,
+    }
+
+
+def _convert_item(item):
+    """
+    在工作进程中转换一张图片，异常和超时都转换为结果中的 error
+    超时由 ITIMER_REAL 信号触发，在 Python 代码之间检查：
+    单个长时间的 C 调用（例如解码一张巨大的图片）结束后才会中断
+    """
+    image_path, output_path = item
+    settings = _worker['settings']
+    timeout = settings['timeout'] if hasattr(signal, 'setitimer') else None
+    result = {'image': image_path, 'output': None, 'notes': 0, 'error': None, 'timed_out': False}
+    
+    start = time.perf_counter()
+    try:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            result['notes'] = convert_image(
+                image_path, output_path, _worker['processor'], _worker['generator'],
+                settings['mode'], settings['octave_shift'], settings['max_notes'])
+            result['output'] = output_path
+        finally:
+            if timeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except ItemTimeout:
+        result['error'] = f"timed out after {timeout:g}s"
+        result['timed_out'] = True
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def summarize(results, elapsed, workers):
+    """
+    汇总批量转换结果
+    返回统计字典（images_per_second 为整个批次的墙钟吞吐量，
+    parallel_efficiency 为各图片处理时间之和 / (墙钟时间 × 进程数)）
+    """
+    converted = [r for r in results if r['error'] is None]
+    busy = sum(r.get('seconds', 0.0) for r in results)
+    return {
+        'total': len(results),
+        'converted': len(converted),
+        'failed': len(results) - len(converted),
+        'timed_out': sum(1 for r in results if r['timed_out']),
+        'notes': sum(r['notes'] for r in converted),
+        'elapsed': elapsed,
+        'workers': workers,
+        'images_per_second': len(results) / elapsed if elapsed > 0 else 0.0,
+        'parallel_efficiency': busy / (elapsed * workers) if elapsed > 0 else 0.0,
+        'failures': [(r['image'], r['error']) for r in results if r['error'] is not None],
+    }
+
+
+def run_batch(items, workers=None, chunksize=None, timeout=60.0, mode='columns', pixel_size=70,
+              block_mode='nearest', reduced_decode=False, octave_shift=0, max_notes=64, note_lut=True,
+              progress_every=100, on_result=None):
+    """
+    并行转换 [(图片路径, MIDI输出路径), ...]，返回 summarize() 的统计字典
+    workers: 进程数，默认为CPU核心数；1 时在当前进程内顺序转换
+    chunksize: 每次分发给一个进程的图片数，默认约为每个进程分到4块
+    timeout: 单张图片的超时（秒），0 或 None 不限制（需要 signal.setitimer，Windows 上不生效）
+    progress_every: 每完成多少张图片打印一次进度，0 不打印
+    on_result: 每完成一张图片调用 on_result(result)
+    """
+    global _worker
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Unknown batch mode: {mode}")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(items) or 1))
+    if chunksize is None:
+        chunksize = max(1, min(32, len(items) // (workers * 4)))
+    
+    settings = {
+        'mode': mode, 'pixel_size': pixel_size, 'block_mode': block_mode, 'reduced_decode': reduced_decode,
+        'octave_shift': octave_shift, 'max_notes': max_notes, 'note_lut': note_lut, 'timeout': timeout,
+    }
+    if timeout and not hasattr(signal, 'setitimer'):
+        print("⚠ Per-image timeout is not supported on this platform")
+    
+    # 在主进程中建立一次查找表缓存，工作进程直接 mmap 打开
+    if note_lut:
+        MelodyGenerator(audio_sink='null').enable_note_lut()
+    
+    results = []
+    start = time.perf_counter()
+    
+    def collect(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+        if progress_every and len(results) % progress_every == 0:
+            rate = len(results) / max(time.perf_counter() - start, 1e-9)
+            print(f"… {len(results)}/{len(items)} images ({rate:.1f} images/s)")
+    
+    if workers == 1:
+        # 在当前进程内转换：结束后恢复原来的 SIGALRM 处理函数
+        previous_handler = signal.getsignal(signal.SIGALRM) if hasattr(signal, 'SIGALRM') else None
+        _init_worker(settings, ignore_interrupt=False)
+        try:
+            for item in items:
+                collect(_convert_item(item))
+        finally:
+            _worker = None
+            if hasattr(signal, 'SIGALRM'):
+                signal.signal(signal.SIGALRM, previous_handler if previous_handler is not None else signal.SIG_DFL)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(settings,)) as executor:
+            try:
+                for result in executor.map(_convert_item, items, chunksize=chunksize):
+                    collect(result)
+            except BrokenProcessPool as e:
+                # 工作进程异常退出（例如内存不足被杀）：剩余图片记为失败
+                print(f"✗ Worker process died: {e}")
+                for image_path, _ in items[len(results):]:
+                    collect({'image': image_path, 'output': None, 'notes': 0,
+                             'error': "worker process died", 'timed_out': False})
+    
+    return summarize(results, time.perf_counter() - start, workers)
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        prog='python -m batch_converter',
+        description="Convert many images (or whole directories) to MIDI in parallel.")
+    parser.add_argument('paths', nargs='+', help="input images or directories (searched recursively)")
+    parser.add_argument('-o', '--output-dir',
+                        help="output directory, keeps the input's relative layout (default: next to each image)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: number of CPU cores)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="images sent to a worker at a time (default: about 4 chunks per worker)")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="per-image timeout in seconds, 0 for none (default: 60)")
+    parser.add_argument('--mode', choices=BATCH_MODES, default='columns',
+                        help="columns: one chord per column; pixels: sampled single-note melody (default: columns)")
+    parser.add_argument('--pixel-size', type=int, default=70, help="block size in pixels (default: 70)")
+    parser.add_argument('--block-mode', choices=BLOCK_MODES, default='nearest',
+                        help="how each block's colour is sampled (default: nearest)")
+    parser.add_argument('--reduced-decode', action='store_true',
+                        help="decode large images at reduced size (faster, blocks become area averages)")
+    parser.add_argument('--octave', type=int, default=0, help="columns mode: pitch shift in semitones (default: 0)")
+    parser.add_argument('--max-notes', type=int, default=64, help="pixels mode: notes per melody (default: 64)")
+    parser.add_argument('--no-note-lut', action='store_true', help="compute notes without the lookup table")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print the summary")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    items = find_images(args.paths, args.output_dir)
+    if not items:
+        print("✗ No images found", file=sys.stderr)
+        return 1
+    
+    def report(result):
+        if result['error'] is not None and not args.quiet:
+            print(f"✗ {result['image']}: {result['error']}", file=sys.stderr)
+    
+    summary = run_batch(
+        items, workers=args.workers, chunksize=args.chunksize, timeout=args.timeout, mode=args.mode,
+        pixel_size=args.pixel_size, block_mode=args.block_mode, reduced_decode=args.reduced_decode,
+        octave_shift=args.octave, max_notes=args.max_notes, note_lut=not args.no_note_lut,
+        progress_every=0 if args.quiet else 100, on_result=report)
+    
+    print(f"\n📦 Batch Complete:")
+    print(f"   Converted: {summary['converted']}/{summary['total']} images, {summary['notes']} notes")
+    print(f"   Failed: {summary['failed']} ({summary['timed_out']} timed out)")
+    print(f"   Time: {summary['elapsed']:.2f}s with {summary['workers']} workers "
+          f"→ {summary['images_per_second']:.1f} images/s "
+          f"({summary['parallel_efficiency']*100:.0f}% parallel efficiency)")
+    
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
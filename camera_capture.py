@@ -0,0 +1,273 @@
+"""
+Camera Capture Module
+摄像头采集线程：后台连续读取帧，只保留最新的一帧（旧帧直接覆盖并计为丢帧）
+界面线程非阻塞地取最新帧，读取延迟不再拖慢预览和键盘响应
+"""
+import threading
+import time
+from collections import deque
+import numpy as np
+from image_processor import aggregate_blocks
+
+
+SAMPLE_MODES = ('mean', 'median', 'dominant')
+
+
+def sample_frame_color(frame, roi=(0.375, 0.375, 0.625, 0.625), grid=(16, 16), mode='mean',
+                       mirrored=True, bgr=True):
+    """
+    在原始摄像头帧的取色区域内按网格采样，聚合为一个颜色
+    frame: (H, W, 3) uint8 数组（cv2 读到的原始帧）
+    roi: 取色区域 (x0, y0, x1, y1)，画面比例坐标（0-1），相对于显示的画面
+    grid: 采样网格 (行, 列)
+    mode: 'mean' - 平均色；'median' - 各通道中位数；
+          'dominant' - 直方图峰值（每通道4位量化后出现最多的颜色）
+    mirrored: 显示的画面是否水平镜像（是则取色区域按镜像换算到原始帧）
+    bgr: 帧是否为 BGR 通道顺序
+    返回 (r, g, b)
+    
+    网格用步长切片取点（视图，不复制整帧），聚合与像素化共用 aggregate_blocks
+    """
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"Unknown sample mode: {mode}")
+    
+    height, width = frame.shape[:2]
+    left, top, right, bottom = roi
+    if mirrored:
+        left, right = 1.0 - right, 1.0 - left
+    x0 = min(width - 1, max(0, int(left * width)))
+    y0 = min(height - 1, max(0, int(top * height)))
+    x1 = max(x0 + 1, min(width, int(right * width)))
+    y1 = max(y0 + 1, min(height, int(bottom * height)))
+    
+    rows, cols = grid
+    step_y = max(1, (y1 - y0) // rows)
+    step_x = max(1, (x1 - x0) // cols)
+    points = frame[y0:y1:step_y, x0:x1:step_x, :3][:rows, :cols]
+    
+    color = aggregate_blocks(points, max(points.shape[:2]), mode)[0, 0]
+    if bgr:
+        color = color[::-1]
+    return int(color[0]), int(color[1]), int(color[2])
+
+
+class FrameRateMeter:
+    """滑动窗口帧率统计"""
+    def __init__(self, window=1.0):
+        """window: 统计窗口（秒）"""
+        self.window = window
+        self.times = deque()
+    
+    def tick(self, timestamp=None):
+        """记录一帧"""
+        now = time.time() if timestamp is None else timestamp
+        self.times.append(now)
+        while self.times and now - self.times[0] > self.window:
+            self.times.popleft()
+    
+    @property
+    def rate(self):
+        """窗口内的平均帧率（帧/秒）"""
+        if len(self.times) < 2:
+            return 0.0
+        span = self.times[-1] - self.times[0]
+        return (len(self.times) - 1) / span if span > 0 else 0.0
+
+
+class CameraCapture:
+    def __init__(self, device=0):
+        """
+        device: 摄像头序号（cv2.VideoCapture 参数）
+        """
+        import cv2
+        
+        self.device = device
+        self.capture = cv2.VideoCapture(device)
+        
+        self.frames_captured = 0   # 采集线程读到的帧
+        self.frames_consumed = 0   # 界面取走的帧
+        self.frames_dropped = 0    # 没被取走就被新帧覆盖的帧
+        self.read_errors = 0
+        self.capture_meter = FrameRateMeter()
+        self.display_meter = FrameRateMeter()
+        
+        self._lock = threading.Lock()
+        self._frame = None          # 最新帧（BGR 数组）
+        self._timestamp = None      # 最新帧的采集时间（time.time()）
+        self._sequence = 0          # 最新帧的序号
+        self._consumed_sequence = 0  # 最近一次被取走的帧序号
+        self._running = False
+        self._thread = None
+        self._release_lock = threading.Lock()
+    
+    def is_opened(self):
+        """摄像头是否打开"""
+        return self.capture is not None and self.capture.isOpened()
+    
+    def start(self):
+        """启动采集线程，摄像头未打开时返回 False"""
+        if self._running:
+            return True
+        if not self.is_opened():
+            return False
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+    
+    def read_latest(self):
+        """
+        非阻塞地取最新帧
+        返回 (frame, timestamp)；自上次取帧以来没有新帧时返回 (None, None)
+        """
+        with self._lock:
+            if self._frame is None or self._sequence == self._consumed_sequence:
+                return None, None
+            self._consumed_sequence = self._sequence
+            frame, timestamp = self._frame, self._timestamp
+            self.frames_consumed += 1
+        self.display_meter.tick()
+        return frame, timestamp
+    
+    def stats(self):
+        """返回采集/显示帧率和丢帧统计"""
+        with self._lock:
+            return {
+                'capture_fps': self.capture_meter.rate,
+                'display_fps': self.display_meter.rate,
+                'captured': self.frames_captured,
+                'displayed': self.frames_consumed,
+                'dropped': self.frames_dropped,
+                'read_errors': self.read_errors,
+            }
+    
+    def release(self):
+        """
+        停止采集线程并释放摄像头
+        采集线程退出循环时自己释放设备；等待超时（线程还卡在 read() 中）时
+        不在这里释放，避免与正在进行的 read() 并发（OpenCV 未定义行为）
+        """
+        self._running = False
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=1.0)
+            if thread.is_alive():
+                print("⚠️  Camera thread still reading, it will release the device when it exits")
+                return
+        self._release_device()
+    
+    def _release_device(self):
+        """释放摄像头（只执行一次）"""
+        with self._release_lock:
+            if self.capture is not None:
+                self.capture.release()
+                self.capture = None
+    
+    def _run(self):
+        """采集线程：读到新帧就覆盖最新帧槽位，停止后释放摄像头"""
+        try:
+            self._capture_loop()
+        finally:
+            self._release_device()
+    
+    def _capture_loop(self):
+        """采集循环，release() 之后退出"""
+        while self._running:
+            try:
+                ret, frame = self.capture.read()
+            except Exception as e:
+                ret, frame = False, None
+                if self.read_errors == 0:
+                    print(f"⚠️  Camera read error: {e}")
+            
+            if not ret:
+                with self._lock:
+                    self.read_errors += 1
+                time.sleep(0.01)
+                continue
+            
+            timestamp = time.time()
+            with self._lock:
+                if self._sequence != self._consumed_sequence:
+                    self.frames_dropped += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self._sequence += 1
+                self.frames_captured += 1
+                self.capture_meter.tick(timestamp)
+
+
+class FramePool:
+    """
+    预分配的帧缓冲池（线程安全）
+    界面线程取缓冲区渲染预览帧，录制时交给编码线程，编码完成后归还
+    """
+    def __init__(self, shape, size=40, dtype=np.uint8):
+        """
+        shape: 每个缓冲区的形状
+        size: 预分配的缓冲区数量（应大于录制队列长度，否则会临时分配）
+        """
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.allocated = size
+        self._free = [np.empty(self.shape, dtype=dtype) for _ in range(size)]
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """取一个空闲缓冲区，池已用完时临时分配一个新的"""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return np.empty(self.shape, dtype=self.dtype)
+    
+    def release(self, buffer):
+        """归还缓冲区（形状不同的缓冲区直接丢弃，例如窗口尺寸改变之后）"""
+        if buffer.shape != self.shape:
+            return
+        with self._lock:
+            self._free.append(buffer)
+
+
+class FrameRenderer:
+    """
+    摄像头预览渲染：镜像和缩放用一次 cv2.remap 完成，
+    再原地转换为 RGBA 写入缓冲池中的缓冲区（Pillow 可以不复制地包装 RGBA 内存）
+    """
+    def __init__(self, pool_size=40):
+        """pool_size: 缓冲池大小"""
+        self.pool_size = pool_size
+        self.pool = None
+        self._key = None
+        self._maps = None
+        self._scratch = None
+    
+    def render(self, frame, size, mirror=True):
+        """
+        frame: 原始 BGR 帧
+        size: 输出尺寸 (width, height)
+        返回池中的 (height, width, 4) RGBA 缓冲区，用完后调用 self.pool.release(buffer)
+        """
+        import cv2
+        
+        width, height = size
+        key = (frame.shape[:2], size, mirror)
+        if key != self._key:
+            # 坐标映射只在帧尺寸或输出尺寸改变时重新计算
+            source_height, source_width = frame.shape[:2]
+            map_x = (np.arange(width, dtype=np.float32) + 0.5) * (source_width / width) - 0.5
+            map_y = (np.arange(height, dtype=np.float32) + 0.5) * (source_height / height) - 0.5
+            if mirror:
+                map_x = (source_width - 1) - map_x
+            map_x, map_y = np.meshgrid(map_x, map_y)
+            self._maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+            self._scratch = np.empty((height, width, 3), dtype=np.uint8)
+            if self.pool is None or self.pool.shape != (height, width, 4):
+                self.pool = FramePool((height, width, 4), self.pool_size)
+            self._key = key
+        
+        cv2.remap(frame, self._maps[0], self._maps[1], cv2.INTER_LINEAR,
+                  dst=self._scratch, borderMode=cv2.BORDER_REPLICATE)
+        buffer = self.pool.acquire()
+        cv2.cvtColor(self._scratch, cv2.COLOR_BGR2RGBA, dst=buffer)
+        return buffer
@@ -0,0 +1,195 @@
+"""
+Dithering Module
+把图像抖动到任意调色板：误差扩散（Floyd-Steinberg / Atkinson / Sierra）和有序 Bayer 抖动
+
+误差扩散按"波前"向量化：像素 (x, y) 只依赖左侧和上方若干行的像素，
+所以 x + k*y 相同的一整条斜线可以同时处理，循环次数从 W×H 降到约 W + k×H。
+Floyd-Steinberg 默认使用 Pillow 内置的 C 实现（quantize），结果略有差别但更快。
+"""
+import numpy as np
+from PIL import Image
+
+
+# 误差扩散核：(除数, [(dx, dy, 权重), ...])，偏移相对于当前像素
+KERNELS = {
+    'floyd_steinberg': (16, [(1, 0, 7), (-1, 1, 3), (0, 1, 5), (1, 1, 1)]),
+    # Atkinson 只扩散 6/8 的误差（高光和暗部更干净）
+    'atkinson': (8, [(1, 0, 1), (2, 0, 1), (-1, 1, 1), (0, 1, 1), (1, 1, 1), (0, 2, 1)]),
+    'sierra': (32, [(1, 0, 5), (2, 0, 3),
+                    (-2, 1, 2), (-1, 1, 4), (0, 1, 5), (1, 1, 4), (2, 1, 2),
+                    (-1, 2, 2), (0, 2, 3), (1, 2, 2)]),
+    'sierra_lite': (4, [(1, 0, 2), (-1, 1, 1), (0, 1, 1)]),
+}
+
+DITHER_METHODS = tuple(KERNELS) + ('bayer',)
+
+
+def bayer_matrix(size=8):
+    """返回 size×size 的 Bayer 阈值矩阵（0 .. size²-1），size 为2的幂"""
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < size:
+        matrix = np.block([
+            [4 * matrix, 4 * matrix + 2],
+            [4 * matrix + 3, 4 * matrix + 1],
+        ])
+    return matrix
+
+
+def nearest_palette_index(pixels, palette):
+    """
+    每个像素在调色板中最接近（欧氏距离）的颜色序号
+    pixels: (..., C) 数组；palette: (P, C) 数组
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    palette = np.asarray(palette, dtype=np.float32)
+    best = np.zeros(pixels.shape[:-1], dtype=np.intp)
+    best_distance = np.full(pixels.shape[:-1], np.inf, dtype=np.float32)
+    for index, color in enumerate(palette):
+        distance = np.square(pixels - color).sum(axis=-1)
+        closer = distance < best_distance
+        best[closer] = index
+        best_distance[closer] = distance[closer]
+    return best
+
+
+def threshold_index(values, palette, threshold):
+    """
+    单通道两色调色板按分界点取色：值大于 threshold 取较亮的颜色，否则取较暗的颜色
+    values: (..., 1) 数组；palette: (2, 1) 数组
+    """
+    if palette.shape != (2, 1):
+        raise ValueError("threshold needs a two-colour single-channel palette")
+    dark, bright = np.argsort(palette[:, 0], kind='stable')
+    return np.where(values[..., 0] > threshold, bright, dark)
+
+
+def error_diffusion(pixels, palette, kernel='floyd_steinberg', threshold=None, clamp=False):
+    """
+    误差扩散抖动（波前向量化）
+    pixels: (H, W, C) 数组；palette: (P, C) 数组
+    kernel: KERNELS 中的名称
+    threshold: 两色灰度调色板的分界点（见 threshold_index），None 时取最近的颜色
+    clamp: 每次扩散后把像素值限制在 0-255 并截断为整数
+           （与逐像素写回8位图像的经典实现逐位一致）
+    返回 (H, W) 调色板序号
+    """
+    divisor, offsets = KERNELS[kernel]
+    height, width, channels = pixels.shape
+    palette = np.asarray(palette, dtype=np.float32)
+    
+    # 波前斜率：保证每个偏移的目标都在更晚的波前上（dx + k*dy > 0）
+    k = max([1] + [(-dx) // dy + 1 for dx, dy, _ in offsets if dy > 0])
+    
+    # 同一波前内，同一目标像素可能同时收到多个来源的误差：
+    # 先应用来源行更靠上的偏移（dy 大），与逐像素扫描的顺序一致
+    offsets = sorted(offsets, key=lambda item: (-item[1], item[0]))
+    weights = [(dx, dy, np.float32(weight / divisor)) for dx, dy, weight in offsets]
+    
+    # 带边距的误差缓冲区，省去每次的边界判断
+    pad_x = max(abs(dx) for dx, _, _ in offsets)
+    pad_y = max(dy for _, dy, _ in offsets)
+    buffer = np.zeros((height + pad_y, width + 2 * pad_x, channels), dtype=np.float32)
+    buffer[:height, pad_x:pad_x + width] = pixels
+    result = np.zeros((height, width), dtype=np.intp)
+    
+    rows = np.arange(height)
+    for wave in range(width + k * (height - 1)):
+        # 本波前上的像素：x = wave - k*y，0 <= x < width
+        y_low = max(0, -(-(wave - width + 1) // k))
+        y_high = min(height - 1, wave // k)
+        if y_low > y_high:
+            continue
+        ys = rows[y_low:y_high + 1]
+        xs = wave - k * ys
+        
+        values = buffer[ys, xs + pad_x]
+        if threshold is None:
+            chosen = nearest_palette_index(values, palette)
+        else:
+            chosen = threshold_index(values, palette, threshold)
+        result[ys, xs] = chosen
+        error = values - palette[chosen]
+        
+        for dx, dy, weight in weights:
+            if clamp:
+                target = (ys + dy, xs + pad_x + dx)
+                buffer[target] = np.trunc(np.clip(buffer[target] + error * weight, 0, 255))
+            else:
+                buffer[ys + dy, xs + pad_x + dx] += error * weight
+    
+    return result
+
+
+def ordered_dither(pixels, palette, matrix_size=8, spread=None, threshold=None):
+    """
+    有序 Bayer 抖动
+    pixels: (H, W, C) 数组；palette: (P, C) 数组
+    spread: 阈值扰动幅度，默认为调色板相邻亮度间距的平均值
+    threshold: 两色灰度调色板的分界点（见 threshold_index），None 时取最近的颜色
+    返回 (H, W) 调色板序号
+    """
+    palette = np.asarray(palette, dtype=np.float32)
+    height, width = pixels.shape[:2]
+    if spread is None:
+        levels = np.unique(palette.mean(axis=1))
+        spread = 255.0 / max(1, len(levels) - 1)
+    
+    matrix = bayer_matrix(matrix_size)
+    offset = (matrix + 0.5) / matrix.size - 0.5
+    offset = np.tile(offset, ((height + matrix_size - 1) // matrix_size,
+                              (width + matrix_size - 1) // matrix_size))[:height, :width]
+    
+    biased = np.asarray(pixels, dtype=np.float32) + (offset * spread)[..., None].astype(np.float32)
+    if threshold is not None:
+        return threshold_index(biased, palette, threshold)
+    return nearest_palette_index(biased, palette)
+
+
+def _native_floyd_steinberg(image, palette):
+    """Pillow 内置的 Floyd-Steinberg（C 实现）"""
+    palette = np.asarray(palette, dtype=np.uint8)
+    if palette.shape[1] == 1:
+        palette = np.repeat(palette, 3, axis=1)
+    
+    # 调色板补满256色：用第一个颜色填充，避免被补齐的黑色条目选中
+    entries = np.repeat(palette[:1], 256, axis=0)
+    entries[:len(palette)] = palette
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(entries.tobytes())
+    
+    quantized = image.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG)
+    index = np.asarray(quantized).astype(np.intp)
+    index[index >= len(palette)] = 0
+    return index
+
+
+def dither(image, palette, method='floyd_steinberg', native=True, threshold=None, clamp=False):
+    """
+    把图像抖动到调色板，返回 RGB 图像
+    image: PIL Image
+    palette: [(r, g, b), ...]；灰度调色板可写成 [(v,), ...]（此时在灰度上计算）
+    method: DITHER_METHODS 之一
+    native: Floyd-Steinberg 是否使用 Pillow 内置实现（给出 threshold 或 clamp 时不使用）
+    threshold: 两色灰度调色板的分界点，None 时取最近的颜色
+    clamp: 误差扩散时每步限制在 0-255 并取整（见 error_diffusion）
+    """
+    if method not in DITHER_METHODS:
+        raise ValueError(f"Unknown dither method: {method}")
+    
+    palette = np.asarray(palette, dtype=np.uint8).reshape(len(palette), -1)
+    grayscale = palette.shape[1] == 1
+    
+    if method == 'floyd_steinberg' and native and threshold is None and not clamp:
+        source = image.convert('L') if grayscale else image
+        index = _native_floyd_steinberg(source, palette)
+    else:
+        pixels = np.asarray(image.convert('L' if grayscale else 'RGB'), dtype=np.float32)
+        if grayscale:
+            pixels = pixels[..., None]
+        if method == 'bayer':
+            index = ordered_dither(pixels, palette, threshold=threshold)
+        else:
+            index = error_diffusion(pixels, palette, method, threshold, clamp)
+    
+    colors = np.repeat(palette, 3, axis=1) if grayscale else palette
+    return Image.fromarray(colors[index], 'RGB')
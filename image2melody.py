@@ -0,0 +1,183 @@
+"""
+Image2Melody Command Line
+无界面批量转换：图片 → MIDI / WAV / MP4，不导入 tkinter、pygame 和 cv2
+
+用法:
+    python -m image2melody photo.jpg                  # 生成 photo.mid
+    python -m image2melody a.png b.jpg --wav --mp4 -o out/
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+from image_processor import ImageProcessor, DecodedImage, BLOCK_MODES
+from melody_generator import MelodyGenerator
+from audio_render import render_notes, render_timed_notes, write_wav
+
+
+def load_image(image_path, max_size=800):
+    """解码图片，最长边缩小到 max_size 以内（与界面的动画一致），max_size 为0时不缩小"""
+    decoded = DecodedImage.open(image_path, max_size=max_size or None)
+    img = decoded.image
+    width, height = img.size
+    if max_size and (width > max_size or height > max_size):
+        ratio = min(max_size / width, max_size / height)
+        img = img.resize((int(width * ratio), int(height * ratio)), Image.Resampling.LANCZOS)
+        decoded = DecodedImage(img, path=image_path)
+    return decoded
+
+
+def fit_pixel_size(image_size, pixel_size, max_blocks):
+    """块数超过 max_blocks 时放大像素块（与界面的动画一致），max_blocks 为0时不限制"""
+    width, height = image_size
+    total_blocks = max(1, width // pixel_size) * max(1, height // pixel_size)
+    if max_blocks and total_blocks > max_blocks:
+        scale_factor = (max_blocks / total_blocks) ** 0.5
+        pixel_size = int(pixel_size / scale_factor)
+    return pixel_size
+
+
+def image_to_notes(image_path, generator, pixel_size=10, block_mode='nearest', max_size=800,
+                   max_blocks=800, octave_shift=0):
+    """
+    按动画的顺序（逐行、每块一个音符）把图片转换为音符
+    返回 (notes, grid, pixel_size)：notes 为音符字典列表，grid 为 (H, W, 4) 块颜色
+    """
+    decoded = load_image(image_path, max_size)
+    pixel_size = fit_pixel_size(decoded.size, pixel_size, max_blocks)
+    
+    processor = ImageProcessor(pixel_size=pixel_size, block_mode=block_mode)
+    grid, _ = processor.extract_rgba_grid(decoded)
+    
+    rgba = grid.reshape(-1, 4)
+    pitches, durations, velocities = generator.lookup_notes(rgba)
+    pitches = np.clip(pitches + octave_shift, 21, 108)
+    
+    notes = [
+        {'pitch': pitch, 'duration': duration, 'velocity': velocity, 'rgb': tuple(color)}
+        for pitch, duration, velocity, color in zip(
+            pitches.tolist(), durations.tolist(), velocities.tolist(), rgba.tolist())
+    ]
+    return notes, grid, pixel_size
+
+
+def write_video(file_path, notes, grid, pixel_size, step=0.06, fps=30, sample_rate=44100):
+    """
+    逐块绘制像素化图像的 MP4（每 step 秒一块），音符在各自的块出现时开始，合成为一个文件
+    """
+    import tempfile
+    from video_recorder import VideoRecorder
+    
+    grid_height, grid_width = grid.shape[:2]
+    canvas = np.full((grid_height * pixel_size, grid_width * pixel_size, 3), 1, dtype=np.uint8)
+    
+    recorder = VideoRecorder(fps=fps)
+    fd, audio_path = tempfile.mkstemp(prefix='image2melody_', suffix='.wav')
+    os.close(fd)
+    try:
+        for index in range(grid_height * grid_width):
+            y, x = divmod(index, grid_width)
+            canvas[y * pixel_size:(y + 1) * pixel_size, x * pixel_size:(x + 1) * pixel_size] = grid[y, x, :3]
+            recorder.add_frame(canvas, index * step, block=True)
+        recorder.finish()
+        
+        start_times = recorder.to_output_time(np.arange(len(notes)) * step)
+        audio = render_timed_notes(notes, start_times, sample_rate, total_duration=recorder.duration)
+        write_wav(audio_path, audio, sample_rate)
+        recorder.save_with_audio(file_path, audio_path)
+    finally:
+        recorder.close()
+        os.remove(audio_path)
+    return file_path
+
+
+def convert(image_path, output_dir=None, midi=True, wav=False, mp4=False, generator=None, **options):
+    """
+    转换一张图片，返回生成的文件路径列表
+    output_dir: 输出目录（默认与图片相同）
+    options: 传给 image_to_notes 的参数，以及 step / fps（MP4）
+    """
+    if generator is None:
+        generator = MelodyGenerator(audio_sink='null')
+    step = options.pop('step', 0.06)
+    fps = options.pop('fps', 30)
+    
+    notes, grid, pixel_size = image_to_notes(image_path, generator, **options)
+    if not notes:
+        raise ValueError("No blocks extracted")
+    
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    base = os.path.join(output_dir or os.path.dirname(os.path.abspath(image_path)), stem)
+    outputs = []
+    
+    if midi:
+        generator.recorded_notes = notes
+        outputs.append(generator.save_recorded_melody(base + '.mid'))
+    if wav:
+        sample_rate = 44100
+        outputs.append(write_wav(base + '.wav', render_notes(notes, sample_rate), sample_rate))
+    if mp4:
+        outputs.append(write_video(base + '.mp4', notes, grid, pixel_size, step, fps))
+    return outputs
+
+
+def non_negative_int(value):
+    """argparse 类型：非负整数（0 表示不限制）"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or positive, got {number}")
+    return number
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        prog='python -m image2melody',
+        description="Convert images to 8-bit melodies (MIDI / WAV / MP4) without the GUI.")
+    parser.add_argument('images', nargs='+', help="input image paths")
+    parser.add_argument('-o', '--output-dir', help="output directory (default: next to each image)")
+    parser.add_argument('--midi', action='store_true', help="write a .mid file (default if no format is given)")
+    parser.add_argument('--wav', action='store_true', help="write a .wav file")
+    parser.add_argument('--mp4', action='store_true', help="write an .mp4 animation with audio")
+    parser.add_argument('--pixel-size', type=int, default=10, help="block size in pixels (default: 10)")
+    parser.add_argument('--block-mode', choices=BLOCK_MODES, default='nearest',
+                        help="how each block's colour is sampled (default: nearest)")
+    parser.add_argument('--max-size', type=non_negative_int, default=800,
+                        help="downscale images to this size first, 0 for no limit (default: 800)")
+    parser.add_argument('--max-blocks', type=non_negative_int, default=800,
+                        help="enlarge blocks above this many blocks, 0 for no limit (default: 800)")
+    parser.add_argument('--octave', type=int, default=0, help="pitch shift in semitones (default: 0)")
+    parser.add_argument('--step', type=float, default=0.06, help="MP4: seconds per block (default: 0.06)")
+    parser.add_argument('--fps', type=int, default=30, help="MP4: frame rate (default: 30)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not (args.midi or args.wav or args.mp4):
+        args.midi = True
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    
+    generator = MelodyGenerator(audio_sink='null')
+    failures = 0
+    for image_path in args.images:
+        start = time.perf_counter()
+        try:
+            outputs = convert(
+                image_path, args.output_dir, args.midi, args.wav, args.mp4, generator,
+                pixel_size=args.pixel_size, block_mode=args.block_mode, max_size=args.max_size,
+                max_blocks=args.max_blocks, octave_shift=args.octave, step=args.step, fps=args.fps)
+        except Exception as e:
+            failures += 1
+            print(f"✗ {image_path}: {e}", file=sys.stderr)
+            continue
+        print(f"✓ {image_path} → {', '.join(outputs)} ({time.perf_counter() - start:.2f}s)")
+    
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,49 +2,526 @@
 Image Processor Module
 处理图像并提取RGB数据
 """
-from PIL import Image
+from contextlib import contextmanager
+import io
+import threading
+
+from PIL import Image, TiffImagePlugin, TiffTags, __version__ as PILLOW_VERSION
 import numpy as np
 
 
+# 像素块颜色的聚合方式
+BLOCK_MODES = ('nearest', 'mean', 'median', 'dominant')
+
+
+def aggregate_blocks(pixels, block_size, mode='mean'):
+    """
+    把 (H, W, C) uint8 数组按 block_size×block_size 的块聚合为 (H//block, W//block, C)
+    通过 reshape 为 (grid_h, block, grid_w, block, C) 一次性向量化计算
+    
+    mode: 'nearest'  - 每块左上角像素
+          'mean'     - 平均色
+          'median'   - 各通道中位数
+          'dominant' - 出现最多的颜色（按每通道4位量化计数，返回该颜色像素的平均值）
+    不足一个整块的右侧和底部边缘被丢弃（与像素化图像尺寸一致）；
+    图像小于一个块时整幅图作为一个块
+    """
+    if mode not in BLOCK_MODES:
+        raise ValueError(f"Unknown block mode: {mode}")
+    
+    height, width, channels = pixels.shape
+    block_h = min(block_size, height)
+    block_w = min(block_size, width)
+    grid_h = height // block_h
+    grid_w = width // block_w
+    
+    if mode == 'nearest':
+        return pixels[:grid_h * block_h:block_h, :grid_w * block_w:block_w]
+    
+    pixels = pixels[:grid_h * block_h, :grid_w * block_w]
+    blocks = pixels.reshape(grid_h, block_h, grid_w, block_w, channels)
+    count = block_h * block_w
+    
+    if mode == 'median':
+        # (grid_h, grid_w, C, block*block)：每块每通道的像素排成一行（uint16排序比uint8快得多）
+        flat = blocks.transpose(0, 2, 4, 1, 3).astype(np.uint16).reshape(grid_h, grid_w, channels, count)
+        flat.sort(axis=3)
+        low, high = (count - 1) // 2, count // 2
+        return ((flat[..., low] + flat[..., high] + 1) // 2).astype(np.uint8)
+    
+    weights = None
+    if mode == 'dominant':
+        # 量化RGB（每通道4位）后对每块排序，找最长的相同颜色段
+        codes = ((pixels[..., 0] & 0xF0).astype(np.uint16) << 4) | (pixels[..., 1] & 0xF0) | (pixels[..., 2] >> 4)
+        codes = codes.reshape(grid_h, block_h, grid_w, block_w)
+        ordered = np.sort(codes.transpose(0, 2, 1, 3).reshape(grid_h, grid_w, count), axis=2)
+        positions = np.arange(count, dtype=np.int32)
+        run_begin = np.ones(ordered.shape, dtype=bool)
+        run_begin[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+        run_start = np.where(run_begin, positions, np.int32(0))
+        np.maximum.accumulate(run_start, axis=2, out=run_start)
+        longest_end = (positions - run_start).argmax(axis=2)
+        dominant = np.take_along_axis(ordered, longest_end[..., None], axis=2)[..., 0]
+        # 只统计主色像素：其他像素置零
+        weights = codes == dominant[:, None, :, None]
+        blocks = np.where(weights[..., None], blocks, np.uint8(0))
+    
+    if grid_h * grid_w < count:
+        # 块数少于块内像素数（例如整幅只有一个块）：直接多轴 sum，避免逐偏移的循环
+        total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    else:
+        # 逐个块内偏移累加：每次都是整幅网格的向量化加法，比多轴 sum 快得多
+        total = np.zeros((grid_h, grid_w, channels), dtype=np.uint32)
+        for dy in range(block_h):
+            for dx in range(block_w):
+                total += blocks[:, dy, :, dx]
+    
+    if weights is None:
+        hits = count
+    else:
+        hits = weights.sum(axis=(1, 3), dtype=np.uint32)[..., None]
+    return ((total + hits // 2) // hits).astype(np.uint8)
+
+
+def reduce_blocks(image, block_size):
+    """
+    'mean' 模式的快速路径：用 Pillow 的 reduce()（C实现）按块求平均，比 NumPy 逐偏移累加快一个数量级
+    image: PIL Image；返回网格尺寸的图像，边缘规则与 aggregate_blocks 相同（与其结果相差不超过±1）
+    RGBA 按通道分别缩小：整幅 RGBA 的 reduce 按预乘 alpha 加权，颜色会偏离逐通道平均
+    """
+    width, height = image.size
+    block_w = min(block_size, width)
+    block_h = min(block_size, height)
+    box = (0, 0, width // block_w * block_w, height // block_h * block_h)
+    
+    if 'A' not in image.getbands():
+        return image.reduce((block_w, block_h), box=box)
+    bands = [band.reduce((block_w, block_h), box=box) for band in image.split()]
+    return Image.merge(image.mode, bands)
+
+
+def alpha_composite(dst, src, out=None):
+    """
+    NumPy 版 Image.alpha_composite（与 Pillow 的整数运算和舍入逐位一致）
+    dst, src: (..., 4) uint8 RGBA 数组（src 叠在 dst 之上）
+    out: 可选的输出数组（可以是 dst 本身），用于只更新大图中的一个区域
+    """
+    dst_a = dst[..., 3].astype(np.uint32)
+    src_a = src[..., 3].astype(np.uint32)
+    
+    # Pillow 的 AlphaComposite.c：PRECISION_BITS = 7，除以255用 ((x >> 8) + x) >> 8 近似
+    out_a255 = src_a * 255 + dst_a * (255 - src_a)
+    coef1 = (src_a * (255 * 255 << 7)) // np.maximum(out_a255, 1)
+    coef2 = (255 << 7) - coef1
+    color = (src[..., :3] * coef1[..., None] + dst[..., :3] * coef2[..., None] + (0x80 << 7))
+    color = (((color >> 8) + color) >> 8) >> 7
+    alpha = out_a255 + 0x80
+    alpha = ((alpha >> 8) + alpha) >> 8
+    
+    if out is None:
+        out = np.empty(np.broadcast_shapes(dst.shape, src.shape), dtype=np.uint8)
+    # 源完全透明时原样保留目标像素
+    transparent = (src_a == 0)[..., None]
+    out[..., :3] = np.where(transparent, dst[..., :3], color)
+    out[..., 3] = np.where(transparent[..., 0], dst[..., 3], alpha)
+    return out
+
+
+class DecodedImage:
+    """
+    已解码的图像句柄
+    每个文件只打开、解码、转换模式一次，可代替路径传给 ImageProcessor 的方法
+    同一尺寸的缩放结果也会被缓存（例如像素化和网格提取共用一次 resize）
+    
+    size 是实际解码出的尺寸，original_size 是文件的原始尺寸
+    （使用缩小解码时两者不同，网格大小始终按 original_size 计算）
+    """
+    def __init__(self, image, path=None, original_size=None, scale_down=1):
+        """
+        image: PIL Image对象
+        path: 来源文件路径（可选，仅用于记录）
+        original_size: 原始尺寸（默认为 image.size）
+        scale_down: 允许的最大整数缩小倍数，>1 时用 reduce() 缩小
+        """
+        if original_size is None:
+            original_size = image.size
+        
+        # 保留RGBA，其他模式统一转换为RGB
+        self.has_alpha = image.mode == 'RGBA'
+        if image.mode not in ['RGB', 'RGBA']:
+            image = image.convert('RGB')
+        image.load()
+        
+        # 整数倍盒式缩小（不低于原始尺寸 / scale_down）
+        if scale_down > 1:
+            target_width = max(1, original_size[0] // scale_down)
+            target_height = max(1, original_size[1] // scale_down)
+            factor = min(image.size[0] // target_width, image.size[1] // target_height)
+            if factor >= 2:
+                image = image.reduce(factor)
+        
+        self.path = path
+        self.image = image
+        self.size = image.size
+        self.original_size = original_size
+        self._rgb = None
+        self._resized = {}
+    
+    @classmethod
+    def open(cls, image_path, scale_down=1, max_size=None):
+        """
+        打开并解码图像文件
+        scale_down: 允许解码结果比原图缩小的最大倍数（1 = 完整解码）
+        max_size: 只需要最长边不超过 max_size 的结果时，按此推算 scale_down
+        
+        JPEG 通过 draft() 在解码时直接按 1/2、1/4、1/8 缩小，
+        峰值内存和耗时随目标尺寸而不是原图分辨率增长；
+        其他格式仍需完整解码，之后用 reduce() 做整数倍缩小。
+        """
+        img = Image.open(image_path)
+        original_size = img.size
+        width, height = original_size
+        
+        if max_size is not None and (width > max_size or height > max_size):
+            ratio = min(max_size / width, max_size / height)
+            scale_down = max(scale_down, int(1 / ratio))
+        
+        if scale_down > 1:
+            # 只有JPEG实现了draft，其他格式调用无效果
+            img.draft(None, (max(1, width // scale_down), max(1, height // scale_down)))
+        
+        return cls(img, path=image_path, original_size=original_size, scale_down=scale_down)
+    
+    def rgb(self):
+        """返回RGB模式的图像（RGBA图像只转换一次）"""
+        if self._rgb is None:
+            self._rgb = self.image if self.image.mode == 'RGB' else self.image.convert('RGB')
+        return self._rgb
+    
+    def resized(self, size):
+        """返回NEAREST缩放到指定尺寸的图像（按尺寸缓存）"""
+        if size not in self._resized:
+            self._resized[size] = self.image.resize(size, Image.Resampling.NEAREST)
+        return self._resized[size]
+    
+    def block_grid(self, size, pixel_size, block_mode='nearest'):
+        """
+        返回网格尺寸的图像，每个像素块一个像素
+        block_mode 为 'nearest' 时等同于 resized()，'mean' 使用 reduce_blocks，
+        'median' / 'dominant' 见 aggregate_blocks
+        """
+        if block_mode == 'nearest':
+            return self.resized(size)
+        
+        key = (size, pixel_size, block_mode)
+        if key not in self._resized:
+            if block_mode == 'mean':
+                grid_image = reduce_blocks(self.image, pixel_size)
+                if grid_image.size != size:
+                    grid_image = grid_image.crop((0, 0) + size)
+                self._resized[key] = grid_image
+            else:
+                grid = aggregate_blocks(np.asarray(self.image), pixel_size, block_mode)
+                grid = np.ascontiguousarray(grid[:size[1], :size[0]])
+                self._resized[key] = Image.fromarray(grid, self.image.mode)
+        return self._resized[key]
+
+
+# 未压缩（raw）数据每个像素的位数，用于计算行跨度
+_RAW_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'LA': 16, 'PA': 16, 'I;16': 16, 'I;16B': 16,
+    'RGB': 24, 'BGR': 24, 'RGBA': 32, 'BGRA': 32, 'RGBX': 32, 'BGRX': 32,
+    'RGBa': 32, 'CMYK': 32,
+}
+
+# 按条带解码压缩TIFF时需要带到单条带文件里的图像结构标签
+_STRIP_TAGS = (
+    256, 258, 259, 262, 266, 277, 278, 284, 317, 320, 338, 339, 347, 529, 530, 531, 532,
+)
+
+# 未压缩格式的条带解码直接改写Pillow的内部状态（_size、_tile_size、tile），
+# 只在验证过的版本范围内启用，其他版本抛出 ValueError
+_RAW_BANDS_PILLOW = ((10, 0), (13, 0))
+_RAW_BANDS_SUPPORTED = (
+    _RAW_BANDS_PILLOW[0] <= tuple(int(part) for part in PILLOW_VERSION.split('.')[:2]) < _RAW_BANDS_PILLOW[1]
+)
+
+# JPEG 只能整幅解码，条带读取时固定用 draft() 按 1/8 缩小解码
+_JPEG_DRAFT_SCALE = 8
+
+# Image.MAX_IMAGE_PIXELS 是进程全局设置，修改和恢复都要在锁内进行
+_pixel_limit_lock = threading.Lock()
+
+
+@contextmanager
+def _unlimited_pixels():
+    """临时关闭Pillow的解压炸弹像素上限（用于打开超大文件的文件头和解码单个条带）"""
+    with _pixel_limit_lock:
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+class BandReader:
+    """
+    按水平条带读取超大图像，峰值内存只有一个条带
+    - 未压缩格式（BMP、PPM/PGM、未压缩TIFF等）每次只解码所需的行
+    - 按条带（strip）存储的压缩TIFF每次只解码与条带重叠的strip
+    - JPEG 只在 nearest 模式且像素块不小于8时支持：用 draft() 按 1/8 解码，
+      解码结果（原图的 1/64）保存在内存中按条带裁剪；scale 为8，
+      每个采样点是8×8区域的平均色，与完整解码的单点采样不同
+    其他格式（PNG、分块TIFF、单strip的压缩TIFF等）无法局部解码，抛出 ValueError
+    """
+    def __init__(self, image_path, block_size=1, block_mode='nearest'):
+        """
+        image_path: 图像路径
+        block_size: 像素块大小，JPEG要求不小于8
+        block_mode: 像素块颜色的取法，JPEG要求为 'nearest'
+        """
+        self.path = image_path
+        self.scale = 1
+        self._decoded = None
+        
+        # 只读取文件头
+        with self._open() as img:
+            self.size = img.size
+            self.mode = img.mode
+            self.format = img.format
+            self._tiles = list(img.tile)
+            
+            if self._tiles and all(self._tile_stride(tile) for tile in self._tiles):
+                if not _RAW_BANDS_SUPPORTED:
+                    raise ValueError(
+                        f"Streaming uncompressed images is not supported on Pillow {PILLOW_VERSION}"
+                    )
+                self._kind = 'raw'
+            elif self._is_stripped_tiff(img):
+                self._kind = 'strips'
+                self._tags = tags = img.tag_v2
+                self._strips = list(zip(tags[TiffImagePlugin.STRIPOFFSETS], tags[TiffImagePlugin.STRIPBYTECOUNTS]))
+                self._rows_per_strip = min(tags.get(TiffImagePlugin.ROWSPERSTRIP, self.size[1]), self.size[1])
+            elif self._can_draft(img, block_size, block_mode):
+                self._kind = 'draft'
+                self.scale = _JPEG_DRAFT_SCALE
+            else:
+                raise ValueError(
+                    f"{self.format} image cannot be streamed in bands (supported: uncompressed formats, "
+                    f"TIFF with multiple strips, JPEG in nearest mode with blocks of {_JPEG_DRAFT_SCALE}+ pixels)"
+                )
+        
+        self.has_alpha = self.mode == 'RGBA'
+        # 实际解码出的尺寸（JPEG缩小解码时小于 size）
+        self.decoded_size = tuple(-(-n // self.scale) for n in self.size)
+    
+    def _open(self):
+        """打开文件（条带读取只解码一小部分，不受解压炸弹像素上限限制）"""
+        with _unlimited_pixels():
+            return Image.open(self.path)
+    
+    def _can_draft(self, img, block_size, block_mode):
+        """JPEG能否按 1/8 缩小解码（draft 在尺寸太小时会选用更小的缩小倍数）"""
+        if img.format != 'JPEG' or block_mode != 'nearest' or block_size < _JPEG_DRAFT_SCALE:
+            return False
+        width, height = self.size
+        self._draft_size = (max(1, width // _JPEG_DRAFT_SCALE), max(1, height // _JPEG_DRAFT_SCALE))
+        img.draft(None, self._draft_size)
+        return bool(img.decoderconfig) and img.decoderconfig[0] == _JPEG_DRAFT_SCALE
+    
+    @staticmethod
+    def _is_stripped_tiff(img):
+        """是否为可逐strip解码的压缩TIFF（多个strip、非分块、非分平面存储）"""
+        if img.format != 'TIFF' or not getattr(img, 'use_load_libtiff', False):
+            return False
+        tags = img.tag_v2
+        return (
+            TiffImagePlugin.STRIPOFFSETS in tags and TiffImagePlugin.TILEWIDTH not in tags
+            and tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) == 1 and len(tags[TiffImagePlugin.STRIPOFFSETS]) > 1
+        )
+    
+    @staticmethod
+    def _tile_stride(tile):
+        """返回raw tile的行跨度（字节），不支持局部解码时返回None"""
+        decoder_name, extents, offset, args = tile
+        if decoder_name != 'raw':
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode, stride = args[0], args[1] if len(args) > 1 else 0
+        if stride:
+            return stride
+        bits = _RAW_BITS.get(rawmode)
+        if bits is None:
+            return None
+        return ((extents[2] - extents[0]) * bits + 7) // 8
+    
+    def read_band(self, y0, y1):
+        """
+        读取第 y0 到 y1 行（不含 y1，按 decoded_size 的坐标），返回RGB或RGBA的PIL Image
+        """
+        if self._kind == 'strips':
+            return self._read_strips(y0, y1)
+        
+        if self._kind == 'draft':
+            # 缩小后的图像只有原图的 1/64，解码一次后按条带裁剪
+            if self._decoded is None:
+                img = self._open()
+                img.draft(None, self._draft_size)
+                self._decoded = DecodedImage(img).image
+            return self._decoded.crop((0, y0, self.decoded_size[0], y1))
+        
+        width = self.size[0]
+        band_tiles = []
+        for tile in self._tiles:
+            decoder_name, (tx0, ty0, tx1, ty1), offset, args = tile
+            a, b = max(y0, ty0), min(y1, ty1)
+            if a >= b:
+                continue
+            
+            stride = self._tile_stride(tile)
+            if isinstance(args, str):
+                args = (args, 0, 1)
+            rawmode = args[0]
+            ystep = args[2] if len(args) > 2 else 1
+            
+            # 把tile的起始偏移移动到条带的第一行（自下而上存储时从最后一行开始）
+            skip_rows = (a - ty0) if ystep >= 0 else (ty1 - b)
+            fields = (
+                decoder_name, (tx0, a - y0, tx1, b - y0),
+                offset + skip_rows * stride, (rawmode, stride, ystep)
+            )
+            # 新版Pillow的tile是namedtuple
+            band_tiles.append(tile._make(fields) if hasattr(tile, '_make') else fields)
+        
+        img = self._open()
+        img._size = (width, y1 - y0)
+        if hasattr(img, '_tile_size'):
+            # TIFF按 _tile_size 分配解码缓冲区
+            img._tile_size = img._size
+        img.tile = band_tiles
+        # TIFF在 load() 时会按 _tile_size 再检查一次像素上限
+        with _unlimited_pixels():
+            return DecodedImage(img).image
+    
+    def _read_strips(self, y0, y1):
+        """
+        解码与 y0..y1 重叠的strip
+        libtiff只能解码完整的文件，这里把这些strip的压缩数据和原文件的
+        图像结构标签拼成一个只有这几行的小TIFF，再交给Pillow解码
+        """
+        width, height = self.size
+        rows_per_strip = self._rows_per_strip
+        first, last = y0 // rows_per_strip, (y1 - 1) // rows_per_strip
+        top = first * rows_per_strip
+        bottom = min(height, (last + 1) * rows_per_strip)
+        
+        chunks = []
+        with open(self.path, 'rb') as f:
+            for offset, byte_count in self._strips[first:last + 1]:
+                f.seek(offset)
+                chunks.append(f.read(byte_count))
+        
+        prefix = self._tags.prefix
+        byteorder = 'little' if prefix == b'II' else 'big'
+        header = prefix + (42).to_bytes(2, byteorder) + (8).to_bytes(4, byteorder)
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=header)
+        for tag in _STRIP_TAGS:
+            if tag in self._tags:
+                ifd.tagtype[tag] = self._tags.tagtype[tag]
+                ifd[tag] = self._tags[tag]
+        ifd[TiffImagePlugin.IMAGELENGTH] = bottom - top
+        for tag in (TiffImagePlugin.STRIPOFFSETS, TiffImagePlugin.STRIPBYTECOUNTS):
+            ifd.tagtype[tag] = TiffTags.LONG
+        
+        # StripOffsets 写入相对值即可，tobytes() 会加上IFD末尾的位置
+        offsets = [0]
+        for chunk in chunks[:-1]:
+            offsets.append(offsets[-1] + len(chunk))
+        ifd[TiffImagePlugin.STRIPOFFSETS] = tuple(offsets)
+        ifd[TiffImagePlugin.STRIPBYTECOUNTS] = tuple(len(chunk) for chunk in chunks)
+        
+        data = header + ifd.tobytes(len(header)) + b''.join(chunks)
+        with _unlimited_pixels():
+            band = DecodedImage(Image.open(io.BytesIO(data))).image
+            return band.crop((0, y0 - top, width, y1 - top))
+    
+    def iter_bands(self, band_height):
+        """
+        逐条带迭代整张图像（按 decoded_size）
+        返回: (y0, (h, W, 4) uint8 数组)，RGB图像的alpha补为255
+        """
+        height = self.decoded_size[1]
+        for y0 in range(0, height, band_height):
+            y1 = min(height, y0 + band_height)
+            band = self.read_band(y0, y1)
+            yield y0, np.asarray(band.convert('RGBA'), dtype=np.uint8)
+        self._decoded = None
+
+
 class ImageProcessor:
-    def __init__(self, sample_rate=100, pixel_size=70):
+    def __init__(self, sample_rate=100, pixel_size=70, reduced_decode=False, block_mode='nearest'):
         """
         初始化图像处理器
         sample_rate: 采样率，从图像中提取多少个点
         pixel_size: 像素化的像素块大小，默认8x8
+        reduced_decode: 按网格大小缩小解码（JPEG draft / reduce），
+                        适合超大图片，块颜色会变为区域平均而非单点采样
+        block_mode: 像素块颜色的取法（'nearest' / 'mean' / 'median' / 'dominant'）
         """
+        if block_mode not in BLOCK_MODES:
+            raise ValueError(f"Unknown block mode: {block_mode}")
+        
         self.sample_rate = sample_rate
         self.pixel_size = pixel_size
         self.pixelated_image = None
+        self.reduced_decode = reduced_decode
+        self.block_mode = block_mode
     
-    def pixelate_image(self, image_path, pixel_size=None):
+    def load(self, image_path, scale_down=1):
+        """
+        解码图像并返回 DecodedImage 句柄
+        image_path: 文件路径、PIL Image 或已有的 DecodedImage（直接返回）
+        scale_down: 允许的最大解码缩小倍数（见 DecodedImage.open）
+        """
+        if isinstance(image_path, DecodedImage):
+            return image_path
+        if isinstance(image_path, Image.Image):
+            return DecodedImage(image_path, scale_down=scale_down)
+        return DecodedImage.open(image_path, scale_down=scale_down)
+    
+    def _decode_scale(self, pixel_size, block_mode):
+        """
+        缩小解码模式下，每个像素块只需要解码出约1个像素
+        聚合模式（mean/median/dominant）需要块内的全部像素，始终完整解码
+        """
+        return pixel_size if self.reduced_decode and block_mode == 'nearest' else 1
+    
+    def pixelate_image(self, image_path, pixel_size=None, block_mode=None):
         """
         将图像像素化为8x8像素块（或自定义大小）
         返回像素化后的PIL Image对象
         支持RGBA（透明度）
+        block_mode: 像素块颜色的取法，默认使用 self.block_mode
         """
         if pixel_size is None:
             pixel_size = self.pixel_size
+        if block_mode is None:
+            block_mode = self.block_mode
         
-        # 打开图像
-        img = Image.open(image_path)
-        
-        # 保留原始模式（RGB或RGBA）
-        original_mode = img.mode
-        
-        # 如果不是RGB或RGBA，转换为RGB
-        if img.mode not in ['RGB', 'RGBA']:
-            img = img.convert('RGB')
+        # 打开图像（保留RGB或RGBA，其他模式转换为RGB）
+        source = self.load(image_path, self._decode_scale(pixel_size, block_mode))
         
         # 获取原始尺寸
-        original_width, original_height = img.size
+        original_width, original_height = source.original_size
         
         # 计算缩小后的尺寸（每个像素块变成1个像素）
         small_width = max(1, original_width // pixel_size)
         small_height = max(1, original_height // pixel_size)
         
-        # 先缩小图像（使用NEAREST插值以保持清晰边缘）
-        img_small = img.resize((small_width, small_height), Image.Resampling.NEAREST)
+        # 先缩小图像（默认NEAREST插值以保持清晰边缘，或按块聚合颜色）
+        img_small = source.block_grid((small_width, small_height), pixel_size, block_mode)
         
         # 再放大回接近原始尺寸（使用NEAREST插值创建像素化效果）
         pixelated_width = small_width * pixel_size
@@ -56,57 +533,145 @@ class ImageProcessor:
         
         return img_pixelated, (small_width, small_height)
     
-    def extract_rgb_from_pixelated(self, image_path, pixel_size=None):
+    def extract_rgb_from_pixelated(self, image_path, pixel_size=None, as_array=False, tiled=False,
+                                   block_mode=None):
         """
         从像素化图像中提取RGB/RGBA数据
         每个像素块提取一个颜色值（支持透明度）
+        as_array: True时返回 (H, W, 4) uint8 数组，而不是元组列表
+        tiled: True时按条带流式读取（见 extract_rgba_grid_tiled）
+        block_mode: 像素块颜色的取法，默认使用 self.block_mode
         """
-        if pixel_size is None:
-            pixel_size = self.pixel_size
+        if tiled:
+            grid, pixelated_img = self.extract_rgba_grid_tiled(image_path, pixel_size, block_mode=block_mode)
+        else:
+            grid, pixelated_img = self.extract_rgba_grid(image_path, pixel_size, block_mode)
         
-        # 像素化图像
-        pixelated_img, (grid_width, grid_height) = self.pixelate_image(image_path, pixel_size)
+        if as_array:
+            return grid, pixelated_img
         
-        # 从缩小的网格中提取每个像素的RGB/RGBA值
-        img = Image.open(image_path)
+        # 元组列表视图（从左到右，从上到下）
+        return self.grid_to_pixels(grid), pixelated_img
+    
+    def extract_rgba_grid(self, image_path, pixel_size=None, block_mode=None):
+        """
+        一次性提取像素块网格颜色
+        返回: ((H, W, 4) uint8 数组, 像素化图像)
+        RGB图像的alpha通道补为255（不透明）
+        """
+        if pixel_size is None:
+            pixel_size = self.pixel_size
+        if block_mode is None:
+            block_mode = self.block_mode
         
-        # 保留原始模式
-        has_alpha = img.mode == 'RGBA'
-        if img.mode not in ['RGB', 'RGBA']:
-            img = img.convert('RGB')
-            has_alpha = False
+        source = self.load(image_path, self._decode_scale(pixel_size, block_mode))
         
-        # 缩小到网格大小
-        img_small = img.resize((grid_width, grid_height), Image.Resampling.NEAREST)
+        # 像素化图像
+        pixelated_img, (grid_width, grid_height) = self.pixelate_image(source, pixel_size, block_mode)
         
-        rgb_data = []
+        # 复用像素化时的网格结果，一次性转换为数组
+        img_small = source.block_grid((grid_width, grid_height), pixel_size, block_mode)
+        grid = np.asarray(img_small.convert('RGBA'), dtype=np.uint8)
         
-        # 遍历每个像素块（从左到右，从上到下）
-        for y in range(grid_height):
-            for x in range(grid_width):
-                pixel = img_small.getpixel((x, y))
-                if has_alpha:
-                    # RGBA模式
-                    r, g, b, a = pixel
-                    rgb_data.append((r, g, b, a))
-                else:
-                    # RGB模式
-                    r, g, b = pixel
-                    rgb_data.append((r, g, b, 255))  # 默认alpha=255（不透明）
-        
-        return rgb_data, pixelated_img
+        return grid, pixelated_img
+    
+    def extract_rgba_grid_tiled(self, image_path, pixel_size=None, band_height=None, block_mode=None):
+        """
+        按水平条带流式提取像素块网格颜色，用于无法完整放入内存的超大图像
+        采样位置与 NEAREST 缩放完全一致，除JPEG外结果与 extract_rgba_grid 相同
+        峰值内存约为一个条带 + 输出网格，无法按条带读取的格式抛出 ValueError
+        JPEG（仅 nearest 模式、pixel_size >= 8）按 1/8 解码，每个采样点为8×8区域的平均色，
+        与 extract_rgba_grid 的单点采样不同，内存为原图的 1/64（见 BandReader）
+        
+        band_height: 每个条带的行数（默认按约16MB自动计算，对齐到像素块）
+        block_mode: 像素块颜色的取法，默认使用 self.block_mode
+        返回: ((H, W, 4) uint8 数组, 网格分辨率的预览图像（每个像素块1个像素）)
+        """
+        if pixel_size is None:
+            pixel_size = self.pixel_size
+        if block_mode is None:
+            block_mode = self.block_mode
+        
+        if isinstance(image_path, BandReader):
+            reader = image_path
+        else:
+            reader = BandReader(image_path, pixel_size, block_mode)
+        if reader.scale > 1 and block_mode != 'nearest':
+            raise ValueError(f"Block mode '{block_mode}' needs a full-resolution band reader")
+        width, height = reader.size
+        
+        grid_width = max(1, width // pixel_size)
+        grid_height = max(1, height // pixel_size)
+        
+        # 与 NEAREST 缩放相同的采样位置（换算到缩小解码后的坐标）
+        xs = self._nearest_positions(width, grid_width) // reader.scale
+        ys = self._nearest_positions(height, grid_height) // reader.scale
+        
+        if band_height is None:
+            band_height = (16 * 1024 * 1024) // (reader.decoded_size[0] * 4)
+        band_height = max(pixel_size, band_height // pixel_size * pixel_size)
+        
+        grid = np.empty((grid_height, grid_width, 4), dtype=np.uint8)
+        
+        for y0, band in reader.iter_bands(band_height):
+            if block_mode != 'nearest':
+                # 条带与像素块对齐，直接按块聚合（底部不足一块的行丢弃）
+                first_row = y0 // pixel_size
+                if first_row < grid_height:
+                    if block_mode == 'mean':
+                        blocks = np.asarray(reduce_blocks(Image.fromarray(band, 'RGBA'), pixel_size))
+                    else:
+                        blocks = aggregate_blocks(band, pixel_size, block_mode)
+                    rows = min(len(blocks), grid_height - first_row)
+                    grid[first_row:first_row + rows] = blocks[:rows, :grid_width]
+                continue
+            
+            # 落在当前条带内的采样行
+            rows = np.nonzero((ys >= y0) & (ys < y0 + band.shape[0]))[0]
+            if len(rows):
+                grid[rows] = band[ys[rows] - y0][:, xs]
+        
+        # 完整尺寸的像素化图像会和原图一样大，这里只返回网格分辨率的图像
+        if reader.has_alpha:
+            preview = Image.fromarray(grid, 'RGBA')
+        else:
+            preview = Image.fromarray(np.ascontiguousarray(grid[..., :3]), 'RGB')
+        self.pixelated_image = preview
+        
+        return grid, preview
+    
+    @staticmethod
+    def _nearest_positions(src_size, dst_size):
+        """
+        复现Pillow NEAREST缩放的源像素位置
+        Pillow从 step*0.5 开始逐个累加 step，这里用同样顺序的累加保证逐位一致
+        """
+        step = src_size / dst_size
+        offsets = np.full(dst_size, step)
+        offsets[0] = step * 0.5
+        return np.cumsum(offsets).astype(np.intp)
+    
+    @staticmethod
+    def grid_to_pixels(grid):
+        """
+        (H, W, 4) 网格数组 -> list of (r, g, b, a)，从左到右，从上到下
+        """
+        return list(map(tuple, grid.reshape(-1, 4).tolist()))
+    
+    @staticmethod
+    def grid_to_columns(grid):
+        """
+        (H, W, 4) 网格数组 -> list of list of (r, g, b, a)，每个子列表为一列（从上到下）
+        """
+        return [list(map(tuple, column)) for column in grid.transpose(1, 0, 2).tolist()]
     
     def extract_rgb_data(self, image_path):
         """
         从图像中提取RGB数据
         使用网格采样方法从图像中提取代表性的RGB值
         """
-        # 打开图像
-        img = Image.open(image_path)
-        
-        # 转换为RGB模式（如果不是的话）
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        # 打开图像（RGB模式）
+        img = self.load(image_path).rgb()
         
         # 获取图像尺寸
         width, height = img.size
@@ -138,17 +703,15 @@ class ImageProcessor:
         高级RGB提取方法
         method: 'grid' - 网格采样, 'random' - 随机采样, 'edge' - 边缘采样
         """
-        img = Image.open(image_path)
-        
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        source = self.load(image_path)
+        img = source.rgb()
         
         width, height = img.size
         rgb_data = []
         
         if method == 'grid':
             # 网格采样（默认方法）
-            return self.extract_rgb_data(image_path)
+            return self.extract_rgb_data(source)
         
         elif method == 'random':
             # 随机采样
@@ -188,12 +751,9 @@ class ImageProcessor:
         """
         获取图像的统计信息
         """
-        img = Image.open(image_path)
-        
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        img = self.load(image_path).rgb()
         
-        img_array = np.array(img)
+        img_array = np.asarray(img)
         
         stats = {
             'size': img.size,
@@ -214,10 +774,7 @@ class ImageProcessor:
         """
         from PIL import ImageDraw
         
-        img = Image.open(image_path)
-        
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        img = self.load(image_path).rgb()
         
         width, height = img.size
         
@@ -247,8 +804,9 @@ class ImageProcessor:
             img_with_points.save(save_path)
         
         return img_with_points
-
-    def extract_rgb_by_columns(self, image_path, pixel_size=None):
+    
+    def extract_rgb_by_columns(self, image_path, pixel_size=None, as_array=False, tiled=False,
+                               block_mode=None):
         """
         按列（Y轴）读取图片，生成和弦数据
         每一列的所有像素生成一个和弦
@@ -256,40 +814,18 @@ class ImageProcessor:
         
         返回: list of list of (r, g, b, a)
         每个子列表代表一列的所有像素颜色
+        as_array: True时返回 (H, W, 4) uint8 数组，grid[:, x] 即第x列
+        tiled: True时按条带流式读取，可处理超出内存的图像
+               （此时返回的像素化图像为网格分辨率，见 extract_rgba_grid_tiled）
+        block_mode: 像素块颜色的取法，默认使用 self.block_mode
         """
-        if pixel_size is None:
-            pixel_size = self.pixel_size
-        
-        # 像素化图像
-        pixelated_img, (grid_width, grid_height) = self.pixelate_image(image_path, pixel_size)
+        if tiled:
+            grid, pixelated_img = self.extract_rgba_grid_tiled(image_path, pixel_size, block_mode=block_mode)
+        else:
+            grid, pixelated_img = self.extract_rgba_grid(image_path, pixel_size, block_mode)
+        grid_height, grid_width = grid.shape[:2]
         
-        # 从缩小的网格中提取每列的所有像素
-        img = Image.open(image_path)
-        
-        # 保留原始模式
-        has_alpha = img.mode == 'RGBA'
-        if img.mode not in ['RGB', 'RGBA']:
-            img = img.convert('RGB')
-            has_alpha = False
-        
-        # 缩小到网格大小
-        img_small = img.resize((grid_width, grid_height), Image.Resampling.NEAREST)
-        
-        columns_data = []
-        
-        # 遍历每一列（从左到右）
-        for x in range(grid_width):
-            column_pixels = []
-            # 遍历该列的所有行（从上到下）
-            for y in range(grid_height):
-                pixel = img_small.getpixel((x, y))
-                if has_alpha:
-                    r, g, b, a = pixel
-                    column_pixels.append((r, g, b, a))
-                else:
-                    r, g, b = pixel
-                    column_pixels.append((r, g, b, 255))
-            
-            columns_data.append(column_pixels)
+        if as_array:
+            return grid, pixelated_img, (grid_width, grid_height)
         
-        return columns_data, pixelated_img, (grid_width, grid_height)
+        return self.grid_to_columns(grid), pixelated_img, (grid_width, grid_height)
@@ -10,10 +10,14 @@ from tkinter import font as tkfont
 from PIL import Image, ImageTk, ImageDraw, ImageFilter, ImageChops
 import threading
 import os
-import pygame
 import random
-from image_processor import ImageProcessor
+from collections import deque
+from image_processor import ImageProcessor, DecodedImage, aggregate_blocks
 from melody_generator import MelodyGenerator
+from audio_engine import AudioWorker
+from audio_render import render_notes, render_timed_notes, write_wav, WavStreamWriter
+from video_recorder import VideoRecorder
+from camera_capture import CameraCapture, FrameRenderer, sample_frame_color
 
 
 class Image2MelodyApp:
@@ -38,11 +42,28 @@ class Image2MelodyApp:
         self.image_processor = ImageProcessor()
         self.melody_generator = MelodyGenerator()
         
+        # 动画音符的播放线程（有界队列，满时丢弃最早的等待音符）
+        self.audio_worker = AudioWorker(max_queue=32, drop_policy='drop_oldest')
+        
+        # 后台加载RGB→音符查找表（首次运行需构建几秒，之后直接 mmap 缓存文件）
+        threading.Thread(target=self.melody_generator.enable_note_lut, daemon=True).start()
+        
         # State variables
         self.current_image_path = None
         self.current_image = None
         self.pixelated_image = None
         self.pixel_size = 10  # 像素方块大小 (10×10)
+        self.block_mode = 'nearest'  # 音频轨块取色方式：nearest / mean / median / dominant
+        
+        # 摄像头实时声音的取色设置
+        self.camera_sample_roi = (0.375, 0.375, 0.625, 0.625)  # 取色区域（显示画面的比例坐标 x0, y0, x1, y1）
+        self.camera_sample_grid = (16, 16)  # 取色网格（行, 列）
+        self.camera_sample_mode = 'mean'  # mean / median / dominant（直方图峰值）
+        
+        # Display state：画布上常驻一个显示分辨率的 PhotoImage，只在画布尺寸或图像尺寸改变时重建
+        self.photo_image = None
+        self.display_geometry = None  # 缓存的缩放尺寸和位置（画布 <Configure> 时失效）
+        self.canvas_size = None
         
         # Animation state
         self.is_animating = False
@@ -59,14 +80,21 @@ class Image2MelodyApp:
         # Data moshing state
         self.glitch_frames = []
         self.moshing_intensity = 0
-        self.trace_background = None  # 用于渐淡trace效果的背景图像
-        self.glitch_history = None  # 用于累积 glitch 效果的历史层
+        self.pixel_array = None  # 当前像素化图像（numpy数组，逐块切片绘制）
+        self.trace_array = None  # 用于渐淡trace效果的背景层（numpy数组）
+        self.trace_blocks = deque()  # 仍在渐淡中的块 (y0, y1, x0, x1)，只对它们做渐淡
+        self.last_frame_shifted = False  # 上一帧是否有整体抖动（下一帧需要整幅更新）
+        self.glitch_array = None  # 用于累积 glitch 效果的历史层（RGBA numpy数组）
+        self.base_array = None  # trace背景 + 像素化图像的合成结果（RGBA，按变化区域更新）
+        self.frame_array = None  # 最终画面：base_array + glitch_array（RGBA，按变化区域更新）
+        self.moshing_seed = None  # glitch 随机种子（None 为随机；固定后每次播放的 glitch 序列相同）
+        self.moshing_rng = None  # numpy.random.Generator，每次开始播放时重建
         
         # Recording state
         self.is_recording = False
-        self.animation_frames = []  # 保存动画帧
+        self.animation_recorder = None  # 动画视频录制（帧直接送入编码器，不保存在内存中）
+        self.animation_frame_count = 0
         self.recorded_audio_data = []  # 保存音频数据（波形数组）
-        self.frame_timestamps = []  # 保存帧时间戳
         
         # 初始化音频系统
         self.init_audio()
@@ -109,30 +137,29 @@ class Image2MelodyApp:
         2. Classic halftone dot patterns
         3. High contrast black and white with colored midtones
         """
+        import numpy as np
+        
         # Convert to RGB and grayscale
         img_rgb = image.convert('RGB')
         img_gray = image.convert('L')
-        rgb_pixels = img_rgb.load()
-        gray_pixels = img_gray.load()
-        width, height = img_rgb.size
-        
-        # Create result image
-        result = Image.new('RGB', (width, height))
-        result_pixels = result.load()
+        rgb = np.asarray(img_rgb)
+        brightness = np.asarray(img_gray)
+        height, width = brightness.shape
         
         # Bitmap color palette (reduced palette for bitmap effect)
-        palette = {
-            'black': (1, 1, 1),               # Pure black
-            'dark_pink': (100, 50, 70),       # Dark pink
-            'mid_pink': (200, 116, 136),      # Main pink
-            'light_pink': (230, 170, 190),    # Light pink
-            'beige': (205, 190, 184),         # Beige
-            'light_beige': (240, 220, 210),   # Light beige
-            'white': (255, 255, 255)          # Pure white
-        }
+        palette = np.array([
+            (1, 1, 1),                        # 0 black: Pure black
+            (100, 50, 70),                    # 1 dark_pink: Dark pink
+            (200, 116, 136),                  # 2 mid_pink: Main pink
+            (230, 170, 190),                  # 3 light_pink: Light pink
+            (205, 190, 184),                  # 4 beige: Beige
+            (240, 220, 210),                  # 5 light_beige: Light beige
+            (255, 255, 255)                   # 6 white: Pure white
+        ], dtype=np.uint8)
+        BLACK, DARK_PINK, MID_PINK, LIGHT_PINK, BEIGE, LIGHT_BEIGE, WHITE = range(7)
         
         # Ordered dithering matrix (8x8 Bayer matrix for bitmap effect)
-        bayer_matrix = [
+        bayer_matrix = np.array([
             [ 0, 32,  8, 40,  2, 34, 10, 42],
             [48, 16, 56, 24, 50, 18, 58, 26],
             [12, 44,  4, 36, 14, 46,  6, 38],
@@ -141,129 +168,79 @@ class Image2MelodyApp:
             [51, 19, 59, 27, 49, 17, 57, 25],
             [15, 47,  7, 39, 13, 45,  5, 37],
             [63, 31, 55, 23, 61, 29, 53, 21]
-        ]
-        
-        # Process each pixel with bitmap effect
-        for y in range(height):
-            for x in range(width):
-                brightness = gray_pixels[x, y]
-                r, g, b = rgb_pixels[x, y]
-                
-                # Calculate color temperature
-                color_temp = (r - b) / 255.0 if (r + b) > 0 else 0
-                
-                # Get dithering threshold from Bayer matrix
-                threshold_index = bayer_matrix[y % 8][x % 8]
-                threshold = (threshold_index / 64.0) * 255
-                
-                # Apply ordered dithering to create bitmap effect
-                if brightness < threshold * 0.2:  # Very dark
-                    color = palette['black']
-                elif brightness < threshold * 0.4:  # Dark
-                    if color_temp > 0:
-                        color = palette['dark_pink']
-                    else:
-                        color = palette['black']
-                elif brightness < threshold * 0.6:  # Mid-dark
-                    if color_temp > 0.1:
-                        color = palette['mid_pink']
-                    else:
-                        color = palette['dark_pink']
-                elif brightness < threshold * 0.8:  # Mid
-                    if color_temp > 0:
-                        color = palette['light_pink']
-                    else:
-                        color = palette['beige']
-                elif brightness < threshold * 1.0:  # Mid-light
-                    if color_temp > -0.1:
-                        color = palette['light_pink']
-                    else:
-                        color = palette['light_beige']
-                else:  # Bright
-                    if color_temp > -0.2:
-                        color = palette['light_pink']
-                    else:
-                        color = palette['white']
-                
-                result_pixels[x, y] = color
+        ])
+        
+        # Band thresholds per Bayer cell: brightness < threshold * k for k = 0.2 ... 1.0
+        # brightness is an integer, so "< x" is the same as "< ceil(x)" and can be compared as uint8
+        threshold = (bayer_matrix / 64.0) * 255
+        band_limits = np.ceil(threshold[None] * np.array([0.2, 0.4, 0.6, 0.8, 1.0])[:, None, None])
+        band_limits = np.tile(band_limits.astype(np.uint8), (1, (height + 7) // 8, (width + 7) // 8))
+        
+        # Band 0 = very dark ... 5 = bright
+        band = np.zeros((height, width), dtype=np.uint8)
+        for limit in band_limits[:, :height, :width]:
+            band += brightness >= limit
+        
+        # Calculate color temperature, classified by the cut points used in the ladder
+        # (r - b) only takes 511 values, so classify them once with the same float math
+        diff = np.arange(-255, 256)
+        color_temp = diff / 255.0
+        temp_class = ((color_temp > 0.1).astype(np.uint8) + (color_temp > 0) +
+                      (color_temp > -0.1) + (color_temp > -0.2))
+        temp = temp_class[rgb[..., 0].astype(np.int16) - rgb[..., 2] + 255]
+        
+        # Apply ordered dithering to create bitmap effect
+        # rows: brightness band, columns: temp class (0: <= -0.2, 1: <= -0.1, 2: <= 0, 3: <= 0.1, 4: > 0.1)
+        color_table = np.array([
+            [BLACK, BLACK, BLACK, BLACK, BLACK],                                  # Very dark
+            [BLACK, BLACK, BLACK, DARK_PINK, DARK_PINK],                          # Dark
+            [DARK_PINK, DARK_PINK, DARK_PINK, DARK_PINK, MID_PINK],               # Mid-dark
+            [BEIGE, BEIGE, BEIGE, LIGHT_PINK, LIGHT_PINK],                        # Mid
+            [LIGHT_BEIGE, LIGHT_BEIGE, LIGHT_PINK, LIGHT_PINK, LIGHT_PINK],       # Mid-light
+            [WHITE, LIGHT_PINK, LIGHT_PINK, LIGHT_PINK, LIGHT_PINK],              # Bright
+        ], dtype=np.uint8)
+        color = color_table[band, temp]
+        
+        result = Image.fromarray(palette[color], 'RGB')
         
         print(f"✓ Bitmap effect applied (ordered dithering + halftone)")
         return result
     
-    def apply_floyd_steinberg_dither(self, image, threshold=128, max_size=800):
-        """Apply Floyd-Steinberg dithering to convert image to 1-bit
+    def apply_floyd_steinberg_dither(self, image, threshold=128, max_size=None, method='floyd_steinberg'):
+        """Dither image to the 1-bit black/beige palette
         
         Args:
             image: PIL Image object
-            threshold: Brightness threshold (default 128)
-            max_size: Maximum dimension to resize large images (default 800)
+            threshold: Brightness threshold (default 128), pixels brighter than it become beige
+            max_size: Optional maximum dimension, larger images are downscaled first (default None, full size)
+            method: One of dithering.DITHER_METHODS (default 'floyd_steinberg')
+        
+        误差扩散每步限制在 0-255 并取整，相同尺寸的输入下 Floyd-Steinberg 的结果与原来的逐像素实现逐位一致
+        （原实现总是先缩小到800，需要相同结果时传 max_size=800）
         """
-        # Resize large images to prevent hanging
+        import numpy as np
+        from dithering import dither
+        
         width, height = image.size
-        if width > max_size or height > max_size:
-            # Calculate new size maintaining aspect ratio
+        if max_size and (width > max_size or height > max_size):
             ratio = min(max_size / width, max_size / height)
             new_width = int(width * ratio)
             new_height = int(height * ratio)
             image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
             print(f"⚠ Large image resized: {width}×{height} → {new_width}×{new_height}")
         
-        # Convert to grayscale
-        img = image.convert('L')
-        pixels = img.load()
-        width, height = img.size
+        # 灰度抖动到黑/白两级，threshold 是量化时的分界点
+        dithered = np.asarray(dither(image.convert('L'), [(0,), (255,)], method,
+                                     threshold=threshold, clamp=True))
         
-        # Process with progress updates
-        total_pixels = width * height
-        processed = 0
-        last_update = 0
-        
-        for y in range(height):
-            for x in range(width):
-                old_pixel = pixels[x, y]
-                new_pixel = 255 if old_pixel > threshold else 0
-                pixels[x, y] = int(new_pixel)
-                
-                # Calculate quantization error
-                quant_error = old_pixel - new_pixel
-                
-                # Distribute error to neighboring pixels (Floyd-Steinberg)
-                if x + 1 < width:
-                    pixels[x + 1, y] = int(min(255, max(0, pixels[x + 1, y] + quant_error * 7 / 16)))
-                
-                if x - 1 >= 0 and y + 1 < height:
-                    pixels[x - 1, y + 1] = int(min(255, max(0, pixels[x - 1, y + 1] + quant_error * 3 / 16)))
-                
-                if y + 1 < height:
-                    pixels[x, y + 1] = int(min(255, max(0, pixels[x, y + 1] + quant_error * 5 / 16)))
-                
-                if x + 1 < width and y + 1 < height:
-                    pixels[x + 1, y + 1] = int(min(255, max(0, pixels[x + 1, y + 1] + quant_error * 1 / 16)))
-                
-                # Update progress every 10%
-                processed += 1
-                progress = int((processed / total_pixels) * 100)
-                if progress >= last_update + 10:
-                    last_update = progress
-                    print(f"  Dithering: {progress}% complete...")
-        
-        # Convert back to RGB with pink/beige colors for 1-bit effect
-        dithered = Image.new('RGB', (width, height))
-        dithered_pixels = dithered.load()
-        
-        for y in range(height):
-            for x in range(width):
-                if pixels[x, y] > 128:
-                    # White pixels -> Beige
-                    dithered_pixels[x, y] = (205, 190, 184)  # hover_beige
-                else:
-                    # Black pixels -> Black
-                    dithered_pixels[x, y] = (1, 1, 1)  # bg_black
+        # White pixels -> Beige (hover_beige), black pixels -> bg_black
+        palette = np.array([[1, 1, 1], [205, 190, 184]], dtype=np.uint8)
+        result = Image.fromarray(palette[(dithered[..., 0] > 128).astype(np.uint8)], 'RGB')
         
         print("✓ Dithering complete!")
-        return dithered
+        return result
     
-    def apply_data_moshing(self, image, intensity=0.0):
+    def apply_data_moshing(self, image, intensity=0.0, rng=None):
         """Apply enhanced glitch effects inspired by retro web aesthetics
         
         包括：
@@ -272,138 +249,119 @@ class Image2MelodyApp:
         3. 像素位移（Pixel Displacement）
         4. 颜色失真（Color Corruption）
         5. 随机噪点（Random Noise）
+        
+        rng: numpy.random.Generator，默认使用 self.moshing_rng
+             （由 self.moshing_seed 创建，种子相同时 glitch 序列相同）
         """
+        import numpy as np
+        
         if intensity <= 0:
             return image
         
-        img = image.copy()
-        width, height = img.size
-        
-        # 1. RGB 通道分离效果（Chromatic Aberration）
-        if intensity > 0.1 and random.random() < intensity:
-            # 分离RGB通道
-            if img.mode == 'RGB' or img.mode == 'RGBA':
-                r, g, b = img.split()[:3]
-                
-                # 随机偏移量
-                offset_x = int(random.randint(-5, 5) * intensity)
-                offset_y = int(random.randint(-2, 2) * intensity)
-                
-                # 创建偏移后的通道
-                r_shifted = ImageChops.offset(r, offset_x, 0)
-                b_shifted = ImageChops.offset(b, -offset_x, offset_y)
-                
-                # 重新合成
-                if img.mode == 'RGBA':
-                    a = img.split()[3]
-                    img = Image.merge('RGBA', (r_shifted, g, b_shifted, a))
-                else:
-                    img = Image.merge('RGB', (r_shifted, g, b_shifted))
-        
-        # 2. 扫描线故障效果
-        pixels = img.load()
+        if rng is None:
+            if self.moshing_rng is None:
+                self.moshing_rng = np.random.default_rng(self.moshing_seed)
+            rng = self.moshing_rng
+        
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        pixels = np.array(image)
+        rgb = pixels[..., :3]
+        height, width = pixels.shape[:2]
+        
+        # 故障调色板（bitmap 风格）
+        corrupt_colors = np.array([
+            (1, 1, 1),           # Black
+            (100, 50, 70),       # Dark pink
+            (200, 116, 136),     # Main pink
+            (230, 170, 190),     # Light pink
+            (255, 255, 255)      # White
+        ], dtype=np.uint8)
+        noise_colors = np.array([
+            (1, 1, 1),           # Black
+            (100, 50, 70),       # Dark pink
+            (200, 116, 136),     # Main pink
+            (230, 170, 190),     # Light pink
+            (205, 190, 184),     # Beige
+            (240, 220, 210),     # Light beige
+            (255, 255, 255)      # White
+        ], dtype=np.uint8)
+        # 亮度 ×1.5 的查找表
+        bright_lut = np.minimum(255, (np.arange(256) * 1.5).astype(np.int64)).astype(np.uint8)
+        
+        # 1. RGB 通道分离效果（Chromatic Aberration）：R 水平偏移，B 反向偏移（环绕）
+        if intensity > 0.1 and rng.random() < intensity:
+            offset_x = int(rng.integers(-5, 6) * intensity)
+            offset_y = int(rng.integers(-2, 3) * intensity)
+            rgb[..., 0] = np.roll(rgb[..., 0], offset_x, axis=1)
+            rgb[..., 2] = np.roll(rgb[..., 2], (offset_y, -offset_x), axis=(0, 1))
+        
+        # 2. 扫描线故障效果：每条扫描线是一行中的一段切片
         num_scanlines = int(height * intensity * 0.3)
         
         for _ in range(num_scanlines):
-            line_y = random.randint(0, height - 1)
-            line_width = random.randint(int(width * 0.2), int(width * 0.8))
-            start_x = random.randint(0, max(0, width - line_width))
+            line_y = int(rng.integers(0, height))
+            line_width = int(rng.integers(int(width * 0.2), int(width * 0.8) + 1))
+            start_x = int(rng.integers(0, max(0, width - line_width) + 1))
             
-            # 扫描线类型
-            scanline_type = random.choice(['repeat', 'shift', 'corrupt', 'bright'])
+            # 第0列不处理（'repeat' 需要左侧像素）
+            low, high = max(1, start_x), min(width, start_x + line_width)
+            if low >= high:
+                continue
             
-            for lx in range(line_width):
-                px = start_x + lx
-                if px < width and px > 0:
-                    try:
-                        if scanline_type == 'repeat':
-                            # 重复前一个像素
-                            pixels[px, line_y] = pixels[px - 1, line_y]
-                        elif scanline_type == 'shift':
-                            # 垂直偏移
-                            shift_y = min(height - 1, max(0, line_y + random.randint(-2, 2)))
-                            pixels[px, line_y] = pixels[px, shift_y]
-                        elif scanline_type == 'corrupt':
-                            # Color corruption - bitmap style palette
-                            corrupt_colors = [
-                                (1, 1, 1),           # Black
-                                (100, 50, 70),       # Dark pink
-                                (200, 116, 136),     # Main pink
-                                (230, 170, 190),     # Light pink
-                                (255, 255, 255)      # White
-                            ]
-                            color = random.choice(corrupt_colors)
-                            if img.mode == 'RGB':
-                                pixels[px, line_y] = color
-                            else:
-                                pixels[px, line_y] = color + (255,)
-                        elif scanline_type == 'bright':
-                            # 增加亮度
-                            pixel = pixels[px, line_y]
-                            if isinstance(pixel, tuple) and len(pixel) >= 3:
-                                r, g, b = pixel[:3]
-                                pixels[px, line_y] = (
-                                    min(255, int(r * 1.5)),
-                                    min(255, int(g * 1.5)),
-                                    min(255, int(b * 1.5))
-                                ) if img.mode == 'RGB' else (
-                                    min(255, int(r * 1.5)),
-                                    min(255, int(g * 1.5)),
-                                    min(255, int(b * 1.5)),
-                                    pixel[3] if len(pixel) == 4 else 255
-                                )
-                    except:
-                        pass
-        
-        # 3. 像素块位移
+            # 扫描线类型：repeat / shift / corrupt / bright
+            scanline_type = int(rng.integers(0, 4))
+            if scanline_type == 0:
+                # 重复：整段被左侧像素填充
+                pixels[line_y, low:high] = pixels[line_y, low - 1]
+            elif scanline_type == 1:
+                # 垂直偏移：每个像素取上下 ±2 行内随机一行
+                source_y = np.clip(line_y + rng.integers(-2, 3, high - low), 0, height - 1)
+                pixels[line_y, low:high] = pixels[source_y, np.arange(low, high)]
+            elif scanline_type == 2:
+                # 颜色失真
+                rgb[line_y, low:high] = corrupt_colors[rng.integers(0, len(corrupt_colors), high - low)]
+                if pixels.shape[2] == 4:
+                    pixels[line_y, low:high, 3] = 255
+            else:
+                # 增加亮度
+                rgb[line_y, low:high] = bright_lut[rgb[line_y, low:high]]
+        
+        # 3. 像素块位移：按块大小分组，每组所有块一次性整体复制（目标坐标截断到图像内）
         num_displacements = int(width * height * intensity * 0.02)
         
-        for _ in range(num_displacements):
-            block_size = random.randint(5, 20)
-            x = random.randint(0, width - block_size - 1)
-            y = random.randint(0, height - block_size - 1)
-            dx = random.randint(-30, 30)
-            dy = random.randint(-10, 10)
-            
-            # 复制块到新位置
-            for by in range(block_size):
-                for bx in range(block_size):
-                    src_x, src_y = x + bx, y + by
-                    dst_x = max(0, min(width - 1, src_x + dx))
-                    dst_y = max(0, min(height - 1, src_y + dy))
-                    try:
-                        pixels[dst_x, dst_y] = pixels[src_x, src_y]
-                    except:
-                        pass
+        if num_displacements and width > 21 and height > 21:
+            block_size = rng.integers(5, 21, num_displacements)
+            x = rng.integers(0, width - block_size)
+            y = rng.integers(0, height - block_size)
+            dx = rng.integers(-30, 31, num_displacements)
+            dy = rng.integers(-10, 11, num_displacements)
+            
+            # RGBA 按 uint32 整像素复制，RGB 按行复制
+            if pixels.shape[2] == 4:
+                flat = pixels.view(np.uint32).reshape(-1)
+            else:
+                flat = pixels.reshape(-1, pixels.shape[2])
+            for size in np.unique(block_size):
+                group = np.flatnonzero(block_size == size)[:, None]
+                offset = np.arange(size)
+                src_y = (y[group] + offset)[:, :, None]
+                src_x = (x[group] + offset)[:, None, :]
+                dst_y = np.clip(src_y + dy[group][:, :, None], 0, height - 1)
+                dst_x = np.clip(src_x + dx[group][:, :, None], 0, width - 1)
+                flat[(dst_y * width + dst_x).ravel()] = flat[(src_y * width + src_x).ravel()]
         
         # 4. 随机噪点（颜色故障）
         num_noise = int(width * height * intensity * 0.01)
         
-        for _ in range(num_noise):
-            nx = random.randint(0, width - 1)
-            ny = random.randint(0, height - 1)
-            
-            # Bitmap style noise palette
-            noise_colors = [
-                (1, 1, 1),           # Black
-                (100, 50, 70),       # Dark pink
-                (200, 116, 136),     # Main pink
-                (230, 170, 190),     # Light pink
-                (205, 190, 184),     # Beige
-                (240, 220, 210),     # Light beige
-                (255, 255, 255)      # White
-            ]
-            
-            try:
-                color = random.choice(noise_colors)
-                if img.mode == 'RGBA':
-                    pixels[nx, ny] = color + (255,)
-                else:
-                    pixels[nx, ny] = color
-            except:
-                pass
+        if num_noise:
+            noise_y = rng.integers(0, height, num_noise)
+            noise_x = rng.integers(0, width, num_noise)
+            rgb[noise_y, noise_x] = noise_colors[rng.integers(0, len(noise_colors), num_noise)]
+            if pixels.shape[2] == 4:
+                pixels[noise_y, noise_x, 3] = 255
         
-        return img
+        return Image.fromarray(pixels, image.mode)
     
     def apply_subtle_shift(self, img):
         """应用微弱的整体画面shift效果（wiredfriend风格）
@@ -654,6 +612,12 @@ class Image2MelodyApp:
         self.status_canvas = status_canvas  # 保存引用用于更新
         
         self.image_canvas.bind('<Button-1>', self.on_canvas_click)
+        self.image_canvas.bind('<Configure>', self.on_canvas_configure)
+    
+    def on_canvas_configure(self, event):
+        """画布尺寸改变：记录新尺寸，下一次显示时重新计算缩放和位置"""
+        self.canvas_size = (event.width, event.height)
+        self.display_geometry = None
     
     def draw_load_button(self):
         """Draw Mac OS Classic style load button in center of canvas"""
@@ -906,7 +870,7 @@ class Image2MelodyApp:
     
     def init_audio(self):
         """初始化音频系统（使用pygame.mixer，无需MIDI设备）"""
-        if self.melody_generator.audio_initialized:
+        if self.melody_generator.ensure_audio():
             print("✓ Audio system ready")
             return True
         else:
@@ -1014,15 +978,17 @@ class Image2MelodyApp:
             self.show_mac_dialog("Error", "opencv-python library is required for camera capture.\n\nInstall with:\npip install opencv-python", dialog_type="error")
             return
         
-        # 打开摄像头
-        self.camera_cap = cv2.VideoCapture(0)
+        # 打开摄像头（后台线程采集，界面只取最新帧）
+        self.camera_cap = CameraCapture(0)
         
-        if not self.camera_cap.isOpened():
+        if not self.camera_cap.start():
+            self.camera_cap.release()
             self.show_mac_dialog("Error", "Could not open camera!", dialog_type="error")
             return
         
         self.camera_active = True
-        self.camera_frame = None
+        self.camera_frame = None  # 最新的原始 BGR 帧（捕获时才转换）
+        self.camera_renderer = FrameRenderer()  # 预览渲染（镜像+缩放+转RGBA，缓冲池与录制共用）
         self.camera_paused = False
         self.camera_octave_shift = 0  # 摄像头模式的音高偏移
         self.camera_speed = 1.0  # 摄像头音频播放速度倍率
@@ -1036,8 +1002,10 @@ class Image2MelodyApp:
         
         # 初始化录制状态
         self.camera_recording = True
-        self.camera_frames = []
-        self.camera_audio_notes = []
+        self.close_camera_recording()
+        self.camera_recorder = VideoRecorder(fps=30)  # 帧直接送入编码器
+        self.camera_frame_count = 0
+        self.camera_audio_sink = WavStreamWriter(note_duration=0.1)  # 录音边录边写入临时WAV（每个音符 100ms）
         self.camera_note_log_counter = 0  # 用于控制日志频率
         
         # 创建右上角状态显示
@@ -1158,29 +1126,32 @@ class Image2MelodyApp:
         if not self.camera_active:
             return
         
-        import cv2
-        import time
-        
         try:
-            ret, frame = self.camera_cap.read()
-            if ret:
-                # 保存当前帧
-                self.camera_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # 非阻塞取最新帧；没有新帧时跳过本次更新
+            frame, timestamp = self.camera_cap.read_latest()
+            if frame is not None:
+                # 保存当前帧（不复制，采集线程每次读到的是新数组）
+                self.camera_frame = frame
                 
-                # 转换为PIL Image并水平翻转（镜像效果）
-                img = Image.fromarray(self.camera_frame)
-                img = img.transpose(Image.FLIP_LEFT_RIGHT)
+                # 镜像 + 缩放到显示尺寸 + 转 RGBA，一次写入缓冲池中的缓冲区，
+                # PIL Image 直接包装这块内存（不复制）
+                buffer = self.camera_renderer.render(frame, self.camera_display_size(frame))
+                release = self.camera_renderer.pool.release
+                img = Image.frombuffer('RGBA', (buffer.shape[1], buffer.shape[0]), buffer, 'raw', 'RGBA', 0, 1)
                 
                 # 显示在主 canvas 上
                 self.display_image(img)
                 
-                # 如果正在录制，保存帧
+                # 如果正在录制，缓冲区直接交给编码线程，编码后归还缓冲池
                 if self.camera_recording and not self.camera_paused:
-                    self.camera_frames.append(img.copy())
+                    self.camera_recorder.add_frame(buffer, timestamp, release=release)
+                    self.camera_frame_count += 1
+                else:
+                    release(buffer)
                 
                 # 🎵 根据摄像头画面中心区域生成实时声音（如果未暂停）
                 if not self.camera_paused:
-                    self.play_camera_audio(img)
+                    self.play_camera_audio(frame)
                 
                 # 更新状态显示
                 self.update_camera_status()
@@ -1196,6 +1167,23 @@ class Image2MelodyApp:
             frame_delay = int(33 / self.camera_speed)  # 基础 30 FPS，受速度影响
             self.root.after(frame_delay, self.update_camera_preview)
     
+    def camera_display_size(self, frame):
+        """摄像头帧缩放到画布内的显示尺寸（与 display_image 的 thumbnail 一致，只缩小不放大）"""
+        canvas_width, canvas_height = self.canvas_size or (800, 500)
+        height, width = frame.shape[:2]
+        scale = min(1.0, (canvas_width - 20) / width, (canvas_height - 20) / height)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+    
+    def release_camera(self):
+        """停止采集线程并释放摄像头，打印采集统计"""
+        if getattr(self, 'camera_cap', None) is None:
+            return
+        stats = self.camera_cap.stats()
+        print(f"📷 Camera: {stats['captured']} captured / {stats['displayed']} displayed / "
+              f"{stats['dropped']} dropped frames")
+        self.camera_cap.release()
+        self.camera_cap = None
+    
     def show_camera_controls(self):
         """在主 canvas 上显示摄像头控制按钮（已禁用 - 只使用键盘控制）"""
         # 不再显示底部按钮，所有控制通过键盘完成
@@ -1341,8 +1329,12 @@ class Image2MelodyApp:
                     # 强制立即刷新（使用 update() 而不是 update_idletasks()）
                     self.image_canvas.update()
                 
-                # 底部状态栏只显示模式和帧数
-                status_bar_text = f"Camera | Frames: {len(self.camera_frames)}"
+                # 底部状态栏显示帧数、采集/显示帧率和丢帧数
+                capture_stats = self.camera_cap.stats()
+                status_bar_text = (f"Camera | Frames: {self.camera_frame_count} | "
+                                   f"Capture: {capture_stats['capture_fps']:.0f} fps | "
+                                   f"Display: {capture_stats['display_fps']:.0f} fps | "
+                                   f"Dropped: {capture_stats['dropped']}")
                 self.status_canvas.itemconfig(self.status_text_id, text=status_bar_text)
                 self.status_canvas.update()
             except Exception as e:
@@ -1362,17 +1354,17 @@ class Image2MelodyApp:
             # 停止声音
             if self.camera_paused:
                 try:
-                    pygame.mixer.stop()
+                    self.melody_generator.stop_all_sounds()
                 except:
                     pass
     
     def save_camera_recording(self):
         """保存摄像头录制的视频和音频"""
-        if not hasattr(self, 'camera_frames') or len(self.camera_frames) == 0:
+        if not getattr(self, 'camera_frame_count', 0):
             self.show_mac_dialog("Info", "No frames recorded yet!\n\nTip: Camera is recording automatically.", dialog_type="info")
             return
         
-        print(f"💾 Saving camera recording: {len(self.camera_frames)} frames, {len(self.camera_audio_notes)} notes")
+        print(f"💾 Saving camera recording: {self.camera_frame_count} frames, {self.camera_audio_sink.note_count} notes")
         
         # 使用文件对话框
         from tkinter import filedialog
@@ -1398,25 +1390,9 @@ class Image2MelodyApp:
         
         # 1. 保存视频
         try:
-            import imageio
-            import numpy as np
-            
-            print(f"📹 Saving video with {len(self.camera_frames)} frames...")
-            
-            # 计算 FPS（基于实际速度）
-            fps = int(30 * self.camera_speed)
-            fps = max(10, min(60, fps))  # 限制在 10-60 FPS
-            
-            # 转换帧为 numpy 数组
-            frames_np = []
-            for i, frame in enumerate(self.camera_frames):
-                frames_np.append(np.array(frame))
-                if (i + 1) % 100 == 0:
-                    print(f"  Converting frame {i + 1}/{len(self.camera_frames)}...")
-            
-            # 保存视频
-            print(f"  Encoding to MP4 (FPS={fps})...")
-            imageio.mimsave(video_path, frames_np, fps=fps, codec='libx264', quality=8)
+            # 帧在录制时已经编码（按时间戳转换为固定 30 FPS），这里只需结束编码并复制
+            print(f"📹 Saving video with {self.camera_frame_count} frames...")
+            self.camera_recorder.save_as(video_path)
             print(f"✅ Video saved: {video_path}")
             saved_files.append(f"Video: {os.path.basename(video_path)}")
             
@@ -1427,50 +1403,12 @@ class Image2MelodyApp:
             self.show_mac_dialog("Error", f"Failed to save video:\n{str(e)}", dialog_type="error")
         
         # 2. 保存音频（如果有音符记录）
-        if len(self.camera_audio_notes) > 0:
+        if self.camera_audio_sink.note_count > 0:
             try:
-                import wave
-                import struct
-                
-                print(f"🎵 Generating audio from {len(self.camera_audio_notes)} notes...")
-                
-                sample_rate = 44100
-                duration_per_note = 0.1  # 每个音符 100ms
-                
-                # 生成音频波形
-                audio_samples = []
-                
-                for i, note_data in enumerate(self.camera_audio_notes):
-                    pitch = note_data['pitch']
-                    velocity = note_data['velocity']
-                    
-                    # 转换为频率
-                    frequency = 440.0 * (2 ** ((pitch - 69) / 12.0))
-                    
-                    # 生成方波
-                    num_samples = int(sample_rate * duration_per_note)
-                    for j in range(num_samples):
-                        t = j / sample_rate
-                        # 方波（8-bit风格）
-                        wave_value = 1.0 if (t * frequency) % 1.0 < 0.5 else -1.0
-                        # 应用音量
-                        amplitude = (velocity / 127.0) * 0.3  # 降低音量避免削波
-                        sample_value = int(wave_value * amplitude * 32767)
-                        audio_samples.append(sample_value)
-                    
-                    if (i + 1) % 100 == 0:
-                        print(f"  Processing note {i + 1}/{len(self.camera_audio_notes)}...")
-                
-                # 保存为 WAV
-                print(f"  Writing WAV file...")
-                with wave.open(audio_path, 'w') as wav_file:
-                    wav_file.setnchannels(1)  # Mono
-                    wav_file.setsampwidth(2)  # 16-bit
-                    wav_file.setframerate(sample_rate)
-                    
-                    # 写入数据
-                    for sample in audio_samples:
-                        wav_file.writeframes(struct.pack('<h', sample))
+                # 音频在录制时已经写入临时WAV，这里只需写入剩余音符并复制
+                print(f"🎵 Saving audio from {self.camera_audio_sink.note_count} notes "
+                      f"({self.camera_audio_sink.duration:.1f}s)...")
+                self.camera_audio_sink.save_as(audio_path)
                 
                 print(f"✅ Audio saved: {audio_path}")
                 saved_files.append(f"Audio: {os.path.basename(audio_path)}")
@@ -1489,12 +1427,23 @@ class Image2MelodyApp:
         else:
             self.show_mac_dialog("Warning", "No files were saved!", dialog_type="warning")
     
+    def close_camera_recording(self):
+        """关闭摄像头录制的临时视频和WAV（未保存的录制被丢弃）"""
+        if getattr(self, 'camera_recorder', None) is not None:
+            self.camera_recorder.close()
+            self.camera_recorder = None
+        if getattr(self, 'camera_audio_sink', None) is not None:
+            self.camera_audio_sink.close()
+            self.camera_audio_sink = None
+    
     def reset_camera(self):
         """重置摄像头设置并清空录制"""
         if hasattr(self, 'camera_active') and self.camera_active:
             # 清空录制数据
-            self.camera_frames = []
-            self.camera_audio_notes = []
+            self.camera_recorder.close()
+            self.camera_recorder = VideoRecorder(fps=30)
+            self.camera_frame_count = 0
+            self.camera_audio_sink.reset()
             
             # 重置所有设置
             self.camera_octave_shift = 0
@@ -1572,75 +1521,52 @@ class Image2MelodyApp:
         dialog.bind('<Return>', lambda e: dialog.destroy())
         dialog.bind('<Escape>', lambda e: dialog.destroy())
     
-    def play_camera_audio(self, img):
-        """根据摄像头画面颜色实时生成声音（使用与图片处理相同的HSV逻辑）"""
-        # 采样中心区域的多个点（避免性能问题）
-        width, height = img.size
-        sample_points = []
+    def play_camera_audio(self, frame):
+        """根据摄像头画面颜色实时生成声音（使用与图片处理相同的HSV逻辑）
         
-        # 在中心区域采样 3x3 网格（9个点，减少计算量）
-        center_x, center_y = width // 2, height // 2
-        grid_size = 3
-        spacing = 60
+        frame: cv2 读到的原始 BGR 帧（未镜像），在取色区域内按网格向量化采样
+        """
+        avg_r, avg_g, avg_b = sample_frame_color(
+            frame, self.camera_sample_roi, self.camera_sample_grid, self.camera_sample_mode,
+            mirrored=True, bgr=True
+        )
         
-        for i in range(grid_size):
-            for j in range(grid_size):
-                x = center_x + (i - grid_size // 2) * spacing
-                y = center_y + (j - grid_size // 2) * spacing
-                
-                # 确保在图像范围内
-                if 0 <= x < width and 0 <= y < height:
-                    sample_points.append((x, y))
-        
-        # 收集所有采样点的RGB值
-        rgb_values = []
-        for x, y in sample_points:
-            pixel_color = img.getpixel((x, y))
-            r, g, b = pixel_color[:3] if len(pixel_color) >= 3 else (pixel_color[0], pixel_color[0], pixel_color[0])
-            rgb_values.append((r, g, b))
-        
-        # 计算平均RGB（更平滑的音频）
-        if rgb_values:
-            avg_r = sum(rgb[0] for rgb in rgb_values) / len(rgb_values)
-            avg_g = sum(rgb[1] for rgb in rgb_values) / len(rgb_values)
-            avg_b = sum(rgb[2] for rgb in rgb_values) / len(rgb_values)
-            
-            # 🎵 使用与图片处理相同的 HSV → 音符转换逻辑
-            pitch, duration, velocity = self.melody_generator.rgba_to_note(
-                int(avg_r), int(avg_g), int(avg_b), 255
-            )
+        # 🎵 使用与图片处理相同的 HSV → 音符转换逻辑
+        pitch, duration, velocity = self.melody_generator.rgba_to_note(
+            avg_r, avg_g, avg_b, 255
+        )
+        
+        # 应用八度偏移
+        pitch += self.camera_octave_shift
+        pitch = max(21, min(108, pitch))  # 限制在钢琴音域内
+        
+        # 记录音符（用于导出）
+        if self.camera_recording and not self.camera_paused:
+            self.camera_audio_sink.add_note({
+                'pitch': pitch,
+                'duration': duration,
+                'velocity': velocity,
+                'rgb': (avg_r, avg_g, avg_b)
+            })
             
-            # 应用八度偏移
-            pitch += self.camera_octave_shift
-            pitch = max(21, min(108, pitch))  # 限制在钢琴音域内
-            
-            # 记录音符（用于导出）
-            if self.camera_recording and not self.camera_paused:
-                self.camera_audio_notes.append({
-                    'pitch': pitch,
-                    'duration': duration,
-                    'velocity': velocity,
-                    'rgb': (int(avg_r), int(avg_g), int(avg_b))
-                })
-                
-                # 每30个音符记录一次日志
-                self.camera_note_log_counter += 1
-                if self.camera_note_log_counter % 30 == 0:
-                    print(f"♪ Note: {pitch} | RGB({int(avg_r)},{int(avg_g)},{int(avg_b)})")
-                
-                # 每100个音符输出一次进度
-                if len(self.camera_audio_notes) % 100 == 0:
-                    print(f"🎵 Recorded {len(self.camera_audio_notes)} notes...")
+            # 每30个音符记录一次日志
+            self.camera_note_log_counter += 1
+            if self.camera_note_log_counter % 30 == 0:
+                print(f"♪ Note: {pitch} | RGB({avg_r},{avg_g},{avg_b})")
             
-            # 🎵 播放短促的音符（实时反馈）
-            # 只在音量足够大时播放（避免静音区域产生噪音）
-            if velocity > 30:  # velocity 阈值
-                try:
-                    # 使用 melody_generator 的播放方法，但持续时间很短
-                    self.melody_generator.play_note_direct(pitch, 0.05, velocity)
-                except Exception as e:
-                    # 静默失败，避免干扰实时预览
-                    pass
+            # 每100个音符输出一次进度
+            if self.camera_audio_sink.note_count % 100 == 0:
+                print(f"🎵 Recorded {self.camera_audio_sink.note_count} notes...")
+        
+        # 🎵 播放短促的音符（实时反馈）
+        # 只在音量足够大时播放（避免静音区域产生噪音）
+        if velocity > 30:  # velocity 阈值
+            try:
+                # 使用 melody_generator 的播放方法，但持续时间很短
+                self.melody_generator.play_note_direct(pitch, 0.05, velocity)
+            except Exception as e:
+                # 静默失败，避免干扰实时预览
+                pass
     
     def capture_camera_frame(self):
         """捕获当前摄像头帧并开始处理"""
@@ -1650,8 +1576,8 @@ class Image2MelodyApp:
         if self.camera_frame is not None:
             # 停止摄像头
             self.camera_active = False
-            if hasattr(self, 'camera_cap') and self.camera_cap.isOpened():
-                self.camera_cap.release()
+            self.close_camera_recording()
+            self.release_camera()
             
             # 移除摄像头控制按钮
             self.image_canvas.delete("camera_control")
@@ -1662,8 +1588,9 @@ class Image2MelodyApp:
                 self.image_canvas.delete(self.camera_status_text)
             self.image_canvas.delete("camera_control_hint")
             
-            # 保存捕获的图片
-            self.current_image = Image.fromarray(self.camera_frame)
+            # 保存捕获的图片（原始帧，未镜像）
+            import cv2
+            self.current_image = Image.fromarray(cv2.cvtColor(self.camera_frame, cv2.COLOR_BGR2RGB))
             self.current_image_path = "camera_capture"
             
             print(f"✅ Image captured: {self.current_image.size}")
@@ -1680,9 +1607,9 @@ class Image2MelodyApp:
         # 停止摄像头
         self.camera_active = False
         self.hide_main_buttons = False  # 允许显示主菜单按钮
+        self.close_camera_recording()
         
-        if hasattr(self, 'camera_cap') and self.camera_cap.isOpened():
-            self.camera_cap.release()
+        self.release_camera()
         
         # 移除摄像头控制按钮
         self.image_canvas.delete("camera_control")
@@ -1698,7 +1625,7 @@ class Image2MelodyApp:
         
         # 停止声音
         try:
-            pygame.mixer.stop()
+            self.melody_generator.stop_all_sounds()
         except:
             pass
         
@@ -1714,7 +1641,7 @@ class Image2MelodyApp:
             self.camera_paused = True
             
             # 询问是否要保存
-            if len(self.camera_frames) > 0:
+            if self.camera_frame_count > 0:
                 # 使用自定义对话框
                 response = self.show_save_confirmation_dialog()
                 
@@ -1727,9 +1654,9 @@ class Image2MelodyApp:
             # 关闭摄像头
             self.camera_active = False
             self.hide_main_buttons = False  # 允许显示主菜单按钮
+            self.close_camera_recording()
             
-            if hasattr(self, 'camera_cap') and self.camera_cap.isOpened():
-                self.camera_cap.release()
+            self.release_camera()
             
             # 移除摄像头控制按钮
             self.image_canvas.delete("camera_control")
@@ -1750,7 +1677,7 @@ class Image2MelodyApp:
             
             # 停止声音
             try:
-                pygame.mixer.stop()
+                self.melody_generator.stop_all_sounds()
             except:
                 pass
             
@@ -1792,7 +1719,7 @@ class Image2MelodyApp:
         title_label.pack(pady=(20, 15))
         
         # 信息文本
-        info_text = f"You have {len(self.camera_frames)} frames recorded.\n\n" + \
+        info_text = f"You have {self.camera_frame_count} frames recorded.\n\n" + \
                     "Do you want to save before going back?"
         
         info_label = tk.Label(
@@ -2017,19 +1944,76 @@ class Image2MelodyApp:
         popup.destroy()
         self.start_pixelation_animation()
     
-    def display_image(self, image):
-        """Display image"""
-        # 如果是摄像头模式，只删除图像，保留状态显示
-        if hasattr(self, 'camera_active') and self.camera_active:
-            # 删除旧的图像（标记为 "camera_image"）
+    def display_image(self, image, dirty_box=None):
+        """Display image
+        
+        复用画布上已有的 PhotoImage：整幅更新时缩放后整体粘贴，
+        dirty_box=(x0, y0, x1, y1)（原图坐标）时只缩放并粘贴变化的区域
+        """
+        camera_mode = hasattr(self, 'camera_active') and self.camera_active
+        tag = "camera_image" if camera_mode else "display_image"
+        
+        geometry = self.display_geometry
+        if (geometry is None or self.photo_image is None
+                or geometry['tag'] != tag or geometry['source_size'] != image.size
+                or not self.image_canvas.type(geometry['item'])):
+            self._rebuild_display(image, tag)
+            return
+        
+        # 非摄像头模式下画布上有其他内容（按钮、弹窗等）时，按原方式清空重建
+        if not camera_mode and dirty_box is None and len(self.image_canvas.find_all()) > 1:
+            self._rebuild_display(image, tag)
+            return
+        
+        width, height = image.size
+        display_width, display_height = geometry['size']
+        
+        if dirty_box is None:
+            if (display_width, display_height) != image.size:
+                # 不使用 reducing_gap：它先做整数倍 reduce()，局部 box 缩放无法与之逐像素对齐
+                image = image.resize(geometry['size'], Image.Resampling.LANCZOS)
+            self.photo_image.paste(image)
+            return
+        
+        # 变化区域映射到显示坐标，四周留出 LANCZOS 滤波半径
+        scale_x = display_width / width
+        scale_y = display_height / height
+        margin = 0 if (display_width, display_height) == image.size else 4
+        x0 = max(0, int(dirty_box[0] * scale_x) - margin)
+        y0 = max(0, int(dirty_box[1] * scale_y) - margin)
+        x1 = min(display_width, int(dirty_box[2] * scale_x + 0.999) + margin)
+        y1 = min(display_height, int(dirty_box[3] * scale_y + 0.999) + margin)
+        if x0 >= x1 or y0 >= y1:
+            return
+        
+        if margin:
+            region = image.resize((x1 - x0, y1 - y0), Image.Resampling.LANCZOS,
+                                  box=(x0 / scale_x, y0 / scale_y, x1 / scale_x, y1 / scale_y))
+        else:
+            region = image.crop((x0, y0, x1, y1))
+        
+        # 用 Tk 的 photo copy 把小块写入常驻图像（-compositingrule set：直接替换而不是叠加透明度）
+        patch = ImageTk.PhotoImage(region)
+        self.photo_image.tk.call(str(self.photo_image), 'copy', str(patch),
+                                 '-to', x0, y0, '-compositingrule', 'set')
+    
+    def _rebuild_display(self, image, tag):
+        """重新计算缩放和位置，创建新的 PhotoImage 和画布图像"""
+        if tag == "camera_image":
+            # 摄像头模式：只删除图像，保留状态显示
             self.image_canvas.delete("camera_image")
         else:
             # 非摄像头模式，删除所有内容
             self.image_canvas.delete("all")
         
-        self.image_canvas.update()
-        canvas_width = self.image_canvas.winfo_width()
-        canvas_height = self.image_canvas.winfo_height()
+        if self.canvas_size is None:
+            self.image_canvas.update()
+            canvas_width = self.image_canvas.winfo_width()
+            canvas_height = self.image_canvas.winfo_height()
+            if canvas_width > 1 and canvas_height > 1:
+                self.canvas_size = (canvas_width, canvas_height)
+        else:
+            canvas_width, canvas_height = self.canvas_size
         
         if canvas_width <= 1:
             canvas_width = 800
@@ -2043,18 +2027,21 @@ class Image2MelodyApp:
         
         x = (canvas_width - self.photo_image.width()) // 2
         y = (canvas_height - self.photo_image.height()) // 2
-        
-        # 在摄像头模式下，给图像添加标签
-        if hasattr(self, 'camera_active') and self.camera_active:
-            self.image_canvas.create_image(x, y, anchor=tk.NW, image=self.photo_image, tags="camera_image")
-            
-            # 确保状态显示在最上层
-            if hasattr(self, 'camera_status_bg'):
-                self.image_canvas.tag_raise(self.camera_status_bg)
-                self.image_canvas.tag_raise(self.camera_status_text)
-                self.image_canvas.tag_raise("camera_control_hint")
-        else:
-            self.image_canvas.create_image(x, y, anchor=tk.NW, image=self.photo_image)
+        item = self.image_canvas.create_image(x, y, anchor=tk.NW, image=self.photo_image, tags=tag)
+        
+        # 在摄像头模式下，确保状态显示在最上层
+        if tag == "camera_image" and hasattr(self, 'camera_status_bg'):
+            self.image_canvas.tag_raise(self.camera_status_bg)
+            self.image_canvas.tag_raise(self.camera_status_text)
+            self.image_canvas.tag_raise("camera_control_hint")
+        
+        self.display_geometry = {
+            'tag': tag,
+            'item': item,
+            'source_size': image.size,
+            'size': img_copy.size,
+            'position': (x, y),
+        }
     
     def start_pixelation_animation(self):
         """Start pixelation animation with original colors - extract top-left pixel of each 40×40 block"""
@@ -2064,8 +2051,9 @@ class Image2MelodyApp:
         try:
             # 清空之前录制的音符和动画帧
             self.melody_generator.clear_recorded_notes()
-            self.animation_frames = []
-            self.frame_timestamps = []
+            self.close_animation_recorder()
+            self.animation_recorder = VideoRecorder(fps=30)
+            self.animation_frame_count = 0
             self.is_recording = True  # 启用录制
             
             self.status_canvas.itemconfig(self.status_text_id, 
@@ -2073,19 +2061,17 @@ class Image2MelodyApp:
             self.root.update()
             
             print(f"Loading image: {self.current_image_path}")
-            img = Image.open(self.current_image_path)
-            print(f"Image loaded: {img.size[0]}×{img.size[1]}, mode: {img.mode}")
-            
-            # 检测是否有透明度通道
-            has_alpha = img.mode == 'RGBA'
-            
-            # 转换为RGB或RGBA（保留原始颜色）
-            if img.mode not in ['RGB', 'RGBA']:
-                img = img.convert('RGB')
-                has_alpha = False
             
             # 如果图片太大，缩小到合理尺寸
+            # 解码时就按目标尺寸缩小（JPEG draft），避免完整解码超大图片
             max_size = 800
+            decoded = DecodedImage.open(self.current_image_path, max_size=max_size)
+            img = decoded.image
+            print(f"Image loaded: {decoded.original_size[0]}×{decoded.original_size[1]}, decoded at {img.size[0]}×{img.size[1]}")
+            
+            # 检测是否有透明度通道（已转换为RGB或RGBA，保留原始颜色）
+            has_alpha = decoded.has_alpha
+            
             width, height = img.size
             if width > max_size or height > max_size:
                 ratio = min(max_size / width, max_size / height)
@@ -2130,58 +2116,27 @@ class Image2MelodyApp:
                 print(f"⚠ Too many blocks, adjusted to: {self.grid_width}×{self.grid_height} blocks")
             
             print("Extracting colors: visual from 1-bit, audio from original...")
-            self.rgb_data_list = []
-            
-            # 计算原始图像和像素化图像的缩放比例
-            orig_width, orig_height = original_img.size
-            scale_x = orig_width / pixel_width
-            scale_y = orig_height / pixel_height
-            
-            # 遍历每个10×10块
-            for grid_y in range(self.grid_height):
-                for grid_x in range(self.grid_width):
-                    # 像素化图像的左上角坐标（用于视觉）
-                    pixel_x = grid_x * self.pixel_size
-                    pixel_y = grid_y * self.pixel_size
-                    
-                    # 原始图像的对应坐标（用于音频）
-                    orig_x = int(pixel_x * scale_x)
-                    orig_y = int(pixel_y * scale_y)
-                    
-                    # 确保不越界
-                    if pixel_x < pixel_width and pixel_y < pixel_height:
-                        # 视觉轨：从1-bit像素化图像提取颜色
-                        visual_pixel = pixelated_img.getpixel((pixel_x, pixel_y))
-                        
-                        # 音频轨：从原始图像提取颜色
-                        if orig_x < orig_width and orig_y < orig_height:
-                            audio_pixel = original_img.getpixel((orig_x, orig_y))
-                        else:
-                            audio_pixel = visual_pixel
-                        
-                        # 处理RGBA (1-bit图像是RGB)
-                        visual_r, visual_g, visual_b = visual_pixel
-                        visual_a = 255
-                        
-                        if has_alpha:
-                            if isinstance(audio_pixel, tuple) and len(audio_pixel) == 4:
-                                audio_r, audio_g, audio_b, audio_a = audio_pixel
-                            else:
-                                audio_r, audio_g, audio_b = audio_pixel
-                                audio_a = 255
-                        else:
-                            if isinstance(audio_pixel, tuple) and len(audio_pixel) >= 3:
-                                audio_r, audio_g, audio_b = audio_pixel[:3]
-                            else:
-                                audio_r = audio_g = audio_b = audio_pixel if isinstance(audio_pixel, int) else 0
-                            audio_a = 255
-                        
-                        # 存储：视觉RGBA（用于显示）+ 音频RGBA（用于旋律）+ 网格坐标
-                        self.rgb_data_list.append((
-                            int(visual_r), int(visual_g), int(visual_b), int(visual_a),  # 视觉轨
-                            int(audio_r), int(audio_g), int(audio_b), int(audio_a),      # 音频轨
-                            grid_x, grid_y
-                        ))
+            
+            # 视觉轨取1-bit图像每块左上角像素，音频轨按 block_mode 聚合原始图像的每个块
+            # （两幅图尺寸相同，整幅网格一次向量化计算）
+            import numpy as np
+            
+            gh, gw, ps = self.grid_height, self.grid_width, self.pixel_size
+            visual = np.asarray(pixelated_img.convert('RGB'))[0:gh * ps:ps, 0:gw * ps:ps]
+            audio = aggregate_blocks(np.asarray(original_img), ps, self.block_mode)[:gh, :gw]
+            
+            opaque = np.full((gh, gw, 1), 255, dtype=np.uint8)
+            if audio.shape[2] == 3:
+                audio = np.concatenate([audio, opaque], axis=2)
+            grid_y, grid_x = np.mgrid[0:gh, 0:gw]
+            
+            # 存储：视觉RGBA（用于显示）+ 音频RGBA（用于旋律）+ 网格坐标，按行优先顺序
+            blocks = np.concatenate([
+                visual, opaque,                                  # 视觉轨
+                audio,                                           # 音频轨
+                grid_x[..., None], grid_y[..., None]
+            ], axis=2, dtype=np.int64).reshape(-1, 10)
+            self.rgb_data_list = list(map(tuple, blocks.tolist()))
             
             print(f"✓ Extracted {len(self.rgb_data_list)} blocks (visual: 1-bit, audio: original)")
             
@@ -2189,8 +2144,10 @@ class Image2MelodyApp:
             pixelated_width = self.grid_width * self.pixel_size
             pixelated_height = self.grid_height * self.pixel_size
             mode = 'RGBA' if has_alpha else 'RGB'
-            self.pixelated_image = Image.new(mode, (pixelated_width, pixelated_height), 
-                                            color=(0, 0, 0, 255) if has_alpha else (0, 0, 0))
+            self.pixel_array = np.zeros((pixelated_height, pixelated_width, len(mode)), dtype=np.uint8)
+            if has_alpha:
+                self.pixel_array[..., 3] = 255
+            self.pixelated_image = Image.fromarray(self.pixel_array, mode)
             
             self.current_pixel_index = 0
             self.is_animating = True
@@ -2219,8 +2176,11 @@ class Image2MelodyApp:
             # Reset data moshing state and trace background
             self.glitch_frames = []
             self.moshing_intensity = 0.0
-            self.trace_background = None  # 重置trace背景
-            self.glitch_history = None  # 重置glitch历史层
+            self.trace_array = None  # 重置trace背景
+            self.trace_blocks.clear()
+            self.last_frame_shifted = False
+            self.glitch_array = None  # 重置glitch历史层（合成层随之重建）
+            self.moshing_rng = None  # 按 moshing_seed 重新开始 glitch 序列
             
             self.status_canvas.itemconfig(self.status_text_id, 
                                          text="[ PLAYING ] Generating melody...")
@@ -2245,85 +2205,72 @@ class Image2MelodyApp:
             self.finish_animation()
             return
         
-        # 初始化trace背景（第一次）
-        if self.trace_background is None:
-            self.trace_background = Image.new(
-                self.pixelated_image.mode, 
-                self.pixelated_image.size, 
-                color=(1, 1, 1, 0) if self.pixelated_image.mode == 'RGBA' else (1, 1, 1)
-            )
+        import numpy as np
         
-        # 初始化glitch历史层（第一次）
-        if self.glitch_history is None:
-            self.glitch_history = Image.new(
-                'RGBA',
-                self.pixelated_image.size,
-                color=(0, 0, 0, 0)  # 透明背景
-            )
+        mode = 'RGBA' if self.pixel_array.shape[2] == 4 else 'RGB'
+        height, width = self.pixel_array.shape[:2]
+        
+        # 初始化trace背景（第一次）
+        if self.trace_array is None:
+            self.trace_array = np.empty_like(self.pixel_array)
+            self.trace_array[...] = (1, 1, 1, 0) if mode == 'RGBA' else (1, 1, 1)
+            # 渐淡查找表：每帧 alpha -> int(alpha * 0.95)
+            self.trace_fade_lut = (np.arange(256) * 0.95).astype(np.uint8)
+            # 255 经过这么多帧后降为0，之后的块不再需要渐淡
+            fade_steps, alpha = 0, 255
+            while alpha:
+                alpha = int(alpha * 0.95)
+                fade_steps += 1
+            self.trace_blocks = deque(maxlen=fade_steps)
+        
+        # 初始化glitch历史层（透明）和合成层（第一次）：之后每帧只重新合成变化的区域
+        if self.glitch_array is None:
+            self.glitch_array = np.zeros((height, width, 4), dtype=np.uint8)
+            self.base_array = np.empty((height, width, 4), dtype=np.uint8)
+            self.frame_array = None
+            self.compose_animation_layers((0, height, 0, width))
+            self.frame_array = self.base_array.copy()
         
         # 解包双轨数据：视觉RGBA + 音频RGBA + 坐标
         pixel_data = self.rgb_data_list[self.current_pixel_index]
         visual_r, visual_g, visual_b, visual_a, audio_r, audio_g, audio_b, audio_a, grid_x, grid_y = pixel_data
         
-        # 绘制像素块到主图像（使用音频轨的原始颜色 + 微弱粒子shift效果）
+        # 绘制像素块到主图像（使用音频轨的原始颜色）
         # 注意：显示使用原始颜色(audio)，音乐也使用原始颜色(audio)
-        import random
-        
-        # 计算当前帧的shift偏移（基于时间的微弱波动）
-        frame_offset = self.current_pixel_index % 60  # 60帧循环
-        shift_x = int(random.random() * 2 - 1) if random.random() < 0.15 else 0  # 15%概率±1像素
-        shift_y = int(random.random() * 2 - 1) if random.random() < 0.10 else 0  # 10%概率±1像素
-        
-        for py in range(self.pixel_size):
-            for px in range(self.pixel_size):
-                pixel_x = grid_x * self.pixel_size + px
-                pixel_y = grid_y * self.pixel_size + py
-                
-                # 添加微弱的1-bit粒子效果（部分像素有轻微位移）
-                use_shift = random.random() < 0.08  # 8%的像素有shift效果
-                final_x = pixel_x + shift_x if use_shift else pixel_x
-                final_y = pixel_y + shift_y if use_shift else pixel_y
-                
-                # 边界检查
-                if final_x < self.pixelated_image.size[0] and final_y < self.pixelated_image.size[1]:
-                    if final_x >= 0 and final_y >= 0:
-                        # 使用音频轨的原始颜色进行显示（确保显示原图的像素化效果）
-                        r_int = int(audio_r)
-                        g_int = int(audio_g)
-                        b_int = int(audio_b)
-                        a_int = int(audio_a)
-                        
-                        # 微弱的颜色抖动（1-bit风格）- 极少数像素
-                        if random.random() < 0.03:  # 3%概率
-                            # 在调色板中随机选择相邻颜色
-                            color_shift = random.choice([
-                                (r_int, g_int, b_int),  # 原色
-                                (max(0, r_int - 20), max(0, g_int - 10), max(0, b_int - 15)),  # 稍暗
-                                (min(255, r_int + 15), min(255, g_int + 10), min(255, b_int + 10))  # 稍亮
-                            ])
-                            r_int, g_int, b_int = color_shift
-                        
-                        # 绘制到主图像和trace背景
-                        if self.pixelated_image.mode == 'RGBA':
-                            self.pixelated_image.putpixel((final_x, final_y), (r_int, g_int, b_int, a_int))
-                            # trace背景不受shift影响
-                            if pixel_x < self.pixelated_image.size[0] and pixel_y < self.pixelated_image.size[1]:
-                                self.trace_background.putpixel((pixel_x, pixel_y), (r_int, g_int, b_int, 255))
-                        else:
-                            self.pixelated_image.putpixel((final_x, final_y), (r_int, g_int, b_int))
-                            if pixel_x < self.pixelated_image.size[0] and pixel_y < self.pixelated_image.size[1]:
-                                self.trace_background.putpixel((pixel_x, pixel_y), (r_int, g_int, b_int))
-        
-        # 应用渐淡效果到trace背景（每个像素透明度降低）
-        if self.pixelated_image.mode == 'RGBA':
-            trace_pixels = self.trace_background.load()
-            width, height = self.trace_background.size
-            for y in range(height):
-                for x in range(width):
-                    r, g, b, a = trace_pixels[x, y]
-                    # 逐渐降低透明度（渐淡效果）
-                    new_a = max(0, int(a * 0.95))  # 每帧降低5%
-                    trace_pixels[x, y] = (r, g, b, new_a)
+        rng = self.moshing_rng
+        if rng is None:
+            rng = self.moshing_rng = np.random.default_rng(self.moshing_seed)
+        
+        y0 = grid_y * self.pixel_size
+        x0 = grid_x * self.pixel_size
+        y1 = min(height, y0 + self.pixel_size)
+        x1 = min(width, x0 + self.pixel_size)
+        
+        if y0 < y1 and x0 < x1:
+            # 块颜色，微弱的颜色抖动（1-bit风格）- 3%的像素随机变为稍暗/稍亮的相邻颜色
+            variants = np.array([
+                (audio_r, audio_g, audio_b),  # 原色
+                (max(0, audio_r - 20), max(0, audio_g - 10), max(0, audio_b - 15)),  # 稍暗
+                (min(255, audio_r + 15), min(255, audio_g + 10), min(255, audio_b + 10))  # 稍亮
+            ], dtype=np.uint8)
+            choice = np.where(rng.random((y1 - y0, x1 - x0)) < 0.03,
+                              rng.integers(0, 3, (y1 - y0, x1 - x0)), 0)
+            block = variants[choice]
+            
+            # 绘制到主图像和trace背景（切片赋值）
+            self.pixel_array[y0:y1, x0:x1, :3] = block
+            self.trace_array[y0:y1, x0:x1, :3] = block
+            if mode == 'RGBA':
+                self.pixel_array[y0:y1, x0:x1, 3] = audio_a
+                self.trace_array[y0:y1, x0:x1, 3] = 255
+                self.trace_blocks.append((y0, y1, x0, x1))
+        
+        # 应用渐淡效果到trace背景：只有最近绘制的块 alpha 不为0，原地查表
+        # （最早的块在被挤出队列前已经淡为0）
+        if mode == 'RGBA':
+            for by0, by1, bx0, bx1 in self.trace_blocks:
+                alpha = self.trace_array[by0:by1, bx0:bx1, 3]
+                np.take(self.trace_fade_lut, alpha, out=alpha, mode='clip')
         
         # Calculate progressive data moshing intensity
         progress = (self.current_pixel_index + 1) / len(self.rgb_data_list)
@@ -2336,54 +2283,72 @@ class Image2MelodyApp:
         else:
             self.moshing_intensity = 0.42 * (1.0 - (progress - 0.8) / 0.2)  # 最后渐弱
         
-        # 合成最终图像：trace背景 + 当前像素化图像
-        final_image = self.trace_background.copy()
-        if self.pixelated_image.mode == 'RGBA':
-            final_image = Image.alpha_composite(final_image, self.pixelated_image)
-        else:
-            final_image.paste(self.pixelated_image, (0, 0))
+        # 本帧画面变化的区域：当前块和仍在渐淡的trace块（同一行中相邻的块合并为一段）
+        dirty_rects = []
+        if mode == 'RGBA':
+            for rect in self.trace_blocks:
+                last = dirty_rects[-1] if dirty_rects else None
+                if last is not None and last[:2] == rect[:2] and last[3] == rect[2]:
+                    dirty_rects[-1] = (last[0], last[1], last[2], rect[3])
+                else:
+                    dirty_rects.append(rect)
+        elif y0 < y1 and x0 < x1:
+            dirty_rects.append((y0, y1, x0, x1))
+        
+        # 整体效果出现时 dirty_box 为 None（整幅更新）
+        dirty_box = None
+        if dirty_rects:
+            dirty_box = [min(r[2] for r in dirty_rects), min(r[0] for r in dirty_rects),
+                         max(r[3] for r in dirty_rects), max(r[1] for r in dirty_rects)]
+        
+        # 合成最终图像：trace背景 + 当前像素化图像，只重新合成变化的区域
+        for rect in dirty_rects:
+            self.compose_animation_layers(rect)
         
         # 更频繁地应用 glitch 效果（每2帧而不是5帧），并累积到历史层
         if self.current_pixel_index % 2 == 0 and self.moshing_intensity > 0.05:
+            dirty_box = None
             # 生成glitch效果
-            glitch_frame = self.apply_data_moshing(final_image.copy(), self.moshing_intensity)
+            glitch_frame = self.apply_data_moshing(Image.fromarray(self.base_array, 'RGBA'), self.moshing_intensity)
             
             # 将glitch效果提取出来（只保留glitch部分，去掉原图）
             # 创建一个只包含glitch artifacts的图层
             if glitch_frame.mode != 'RGBA':
                 glitch_frame = glitch_frame.convert('RGBA')
             
-            # 累积到glitch历史层（alpha混合）
-            self.glitch_history = Image.alpha_composite(self.glitch_history, glitch_frame)
+            # 累积到glitch历史层（alpha混合），glitch 帧整幅重新合成最终画面
+            self.glitch_array[...] = np.asarray(
+                Image.alpha_composite(Image.fromarray(self.glitch_array, 'RGBA'), glitch_frame))
+            self.frame_array[...] = np.asarray(
+                Image.alpha_composite(Image.fromarray(self.base_array, 'RGBA'), Image.fromarray(self.glitch_array, 'RGBA')))
             
             # 可选：让历史层逐渐淡化（如果希望旧的glitch慢慢消失）
             # 取消下面的注释来启用淡化效果
-            # glitch_pixels = self.glitch_history.load()
-            # width, height = self.glitch_history.size
-            # for y in range(height):
-            #     for x in range(width):
-            #         r, g, b, a = glitch_pixels[x, y]
-            #         new_a = max(0, int(a * 0.98))  # 每帧降低2%（比trace慢）
-            #         glitch_pixels[x, y] = (r, g, b, new_a)
-        
-        # 合成所有层：final_image + glitch_history
-        if self.glitch_history.mode == 'RGBA':
-            final_image = Image.alpha_composite(final_image.convert('RGBA'), self.glitch_history)
+            # alpha = self.glitch_array[..., 3]
+            # alpha[...] = alpha * 0.98  # 每帧降低2%（比trace慢）
+        
+        # 最终画面（与 frame_array 共享内存，只读）
+        final_image = Image.fromarray(self.frame_array, 'RGBA')
         
         # 添加微弱的整体画面shift效果（wiredfriend风格）
-        if random.random() < 0.20:  # 20%概率出现整体抖动
-            final_image = self.apply_subtle_shift(final_image)
+        # 抖动的帧和它之后的一帧都需要整幅更新
+        shifted = random.random() < 0.20  # 20%概率出现整体抖动
+        if shifted:
+            final_image = self.apply_subtle_shift(final_image.copy())
+        if shifted or self.last_frame_shifted:
+            dirty_box = None
+        self.last_frame_shifted = shifted
         
-        self.display_image(final_image)
+        self.display_image(final_image, dirty_box)
         
         # 如果正在录制，保存当前帧
-        if self.is_recording:
+        if self.is_recording and self.animation_recorder is not None:
             import time
-            self.animation_frames.append(final_image.copy())
-            self.frame_timestamps.append(time.time())
+            self.animation_recorder.add_frame(final_image, time.time())
+            self.animation_frame_count += 1
         
-        # 使用音频轨的原始颜色播放音符
-        threading.Thread(target=self.play_note_for_pixel, args=(audio_r, audio_g, audio_b, audio_a), daemon=True).start()
+        # 使用音频轨的原始颜色播放音符（在主线程按动画顺序记录，播放交给音频线程）
+        self.play_note_for_pixel(audio_r, audio_g, audio_b, audio_a)
         
         # 计算HSV用于显示（从音频轨的原始颜色）
         h, s, v = self.melody_generator.rgb_to_hsv(audio_r, audio_g, audio_b)
@@ -2408,24 +2373,49 @@ class Image2MelodyApp:
         
         self.root.after(duration_ms, self.animate_next_pixel)
     
+    def compose_animation_layers(self, rect):
+        """
+        重新合成一个区域 rect=(y0, y1, x0, x1)：
+        base_array = trace背景 + 像素化图像，frame_array = base_array + glitch历史层
+        （RGB 时像素化图像不透明，直接覆盖trace）
+        """
+        from image_processor import alpha_composite
+        
+        y0, y1, x0, x1 = rect
+        region = (slice(y0, y1), slice(x0, x1))
+        base = self.base_array[region]
+        if self.pixel_array.shape[2] == 4:
+            alpha_composite(self.trace_array[region], self.pixel_array[region], out=base)
+        else:
+            base[..., :3] = self.pixel_array[region]
+            base[..., 3] = 255
+        if self.frame_array is not None:
+            alpha_composite(base, self.glitch_array[region], out=self.frame_array[region])
+    
     def play_note_for_pixel(self, r, g, b, a=255):
-        """Play 8-bit style note for single pixel with HSV-based RGBA support"""
+        """Play 8-bit style note for single pixel with HSV-based RGBA support
+        
+        音符在调用线程（主线程）中计算并按顺序记录，播放交给 audio_worker
+        """
         try:
+            import time
+            
             # 使用HSV-based RGBA生成音符
             pitch, duration, velocity = self.melody_generator.rgba_to_note(r, g, b, a)
             pitch += self.octave_shift
             pitch = max(21, min(108, pitch))
             
-            # 记录音符用于保存
+            # 记录音符用于保存（时间戳与录制视频帧使用同一时钟，导出时据此对齐）
             self.melody_generator.recorded_notes.append({
                 'pitch': pitch,
                 'duration': duration,
                 'velocity': velocity,
-                'rgb': (r, g, b, a)
+                'rgb': (r, g, b, a),
+                'timestamp': time.time()
             })
             
             # 直接播放波形音频（无需MIDI设备）
-            self.melody_generator.play_note_direct(pitch, duration, velocity)
+            self.audio_worker.submit(self.melody_generator.play_note_direct, pitch, duration, velocity)
             
             # 调试输出
             if self.current_pixel_index % 10 == 0:
@@ -2443,9 +2433,14 @@ class Image2MelodyApp:
         self.animation_paused = False
         self.hide_main_buttons = False  # 动画结束后允许显示主菜单按钮
         
-        # 停止所有正在播放的声音
+        # 动画中只更新 pixel_array，结束时同步像素化图像
+        if self.pixel_array is not None:
+            self.pixelated_image = Image.fromarray(self.pixel_array, 'RGBA' if self.pixel_array.shape[2] == 4 else 'RGB')
+        
+        # 停止所有正在播放和等待播放的声音
+        self.audio_worker.clear()
         try:
-            pygame.mixer.stop()
+            self.melody_generator.stop_all_sounds()
         except:
             pass
         
@@ -2461,12 +2456,29 @@ class Image2MelodyApp:
         print("🔄 Auto-reset: Speed = 1.0x, Pitch = 0")
         
         total_notes = len(self.melody_generator.recorded_notes)
-        total_frames = len(self.animation_frames) if self.animation_frames else 0
+        total_frames = self.animation_frame_count
+        
+        # 结束视频编码（只需编码队列中剩余的几帧）
+        if self.animation_recorder is not None:
+            try:
+                self.animation_recorder.finish()
+            except Exception as e:
+                print(f"✗ Video recording failed: {e}")
         
         print(f"\n🎬 Animation Complete:")
         print(f"   Notes recorded: {total_notes}")
         print(f"   Frames recorded: {total_frames}")
         print(f"   Recording was: {'ON' if self.is_recording else 'OFF'}")
+        cache_stats = self.melody_generator.sound_cache.stats()
+        print(f"   Sound cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+              f"({cache_stats['hit_rate']*100:.1f}%), {cache_stats['evictions']} evictions")
+        if self.melody_generator.audio_engine is not None:
+            engine_stats = self.melody_generator.audio_engine.stats()
+            print(f"   Audio engine: {engine_stats['stolen_voices']} stolen / "
+                  f"{engine_stats['dropped_voices']} dropped voices, "
+                  f"{engine_stats['limited_blocks']} gain-limited blocks")
+        worker_stats = self.audio_worker.stats()
+        print(f"   Audio worker: {worker_stats['completed']} played / {worker_stats['dropped']} dropped")
         
         self.status_canvas.itemconfig(self.status_text_id,
             text=f"[ COMPLETE ] Generated {total_notes} notes, {total_frames} frames | EXPORT OPTIONS")
@@ -2482,7 +2494,7 @@ class Image2MelodyApp:
         y_pos = canvas_height // 2 - 100  # 垂直位置
         
         # 确定要显示的按钮数量
-        has_video = bool(self.animation_frames)
+        has_video = self.animation_frame_count > 0 and self.animation_recorder is not None
         num_buttons = 4 if has_video else 3  # MIDI, VIDEO(可选), AUDIO, NEW
         
         # 计算总宽度并居中
@@ -2574,7 +2586,7 @@ class Image2MelodyApp:
         self.image_canvas.tag_bind("save_button", "<Leave>", self.on_save_button_leave)
         
         # 绑定导出视频按钮
-        if self.animation_frames:
+        if has_video:
             self.image_canvas.tag_bind("export_video_button", "<Button-1>", lambda e: self.export_video())
             self.image_canvas.tag_bind("export_video_button", "<Enter>", self.on_export_video_button_enter)
             self.image_canvas.tag_bind("export_video_button", "<Leave>", self.on_export_video_button_leave)
@@ -2676,73 +2688,64 @@ class Image2MelodyApp:
                 self.show_mac_dialog("Error", f"Failed to save melody: {str(e)}", dialog_type="error")
     
     def export_video(self):
-        """导出视频（包含音频）"""
-        if not self.animation_frames:
+        """导出视频（录制时已经编码完成，这里只渲染音频并合成，视频流不重新编码）"""
+        if not self.animation_frame_count or self.animation_recorder is None:
             self.show_mac_dialog("No Video", "No animation frames to export!\n\nFrames are only recorded during animation playback.", dialog_type="warning")
             return
         
-        print(f"📹 Starting video export: {len(self.animation_frames)} frames")
+        print(f"📹 Starting video export: {self.animation_frame_count} frames")
         
         file_path = filedialog.asksaveasfilename(
             title="Export Video",
             defaultextension=".mp4",
             filetypes=[
                 ("MP4 Video", "*.mp4"),
-                ("AVI Video", "*.avi"),
                 ("All Files", "*.*")
             ]
         )
         
         if file_path:
             try:
-                import numpy as np
-                
-                # 检查是否安装了 imageio
-                try:
-                    import imageio
-                    print(f"✓ imageio loaded: {imageio.__version__}")
-                except ImportError:
-                    print("✗ imageio not installed")
-                    self.show_mac_dialog("Error", "imageio library is required for video export.\n\nInstall with:\npip install imageio imageio-ffmpeg", dialog_type="error")
-                    return
-                
                 self.status_canvas.itemconfig(self.status_text_id,
-                    text="[ EXPORTING ] Rendering video...")
+                    text="[ EXPORTING ] Saving video...")
                 self.root.update()
                 
-                # 计算帧率（基于时间戳）
-                if len(self.frame_timestamps) > 1:
-                    avg_frame_time = (self.frame_timestamps[-1] - self.frame_timestamps[0]) / len(self.frame_timestamps)
-                    fps = int(1.0 / max(avg_frame_time, 0.016))  # 最小16ms = 60fps
-                    fps = max(10, min(fps, 60))  # 限制在 10-60 fps
-                else:
-                    fps = 30
-                
-                print(f"📊 Video settings: {len(self.animation_frames)} frames @ {fps} FPS")
-                
-                # 转换PIL图像为numpy数组
-                video_frames = []
-                for i, frame in enumerate(self.animation_frames):
-                    if i % 100 == 0:
-                        print(f"  Converting frame {i+1}/{len(self.animation_frames)}...")
-                    if frame.mode != 'RGB':
-                        frame = frame.convert('RGB')
-                    video_frames.append(np.array(frame))
+                recorder = self.animation_recorder
+                recorder.finish()
+                notes = self.melody_generator.recorded_notes
                 
                 print(f"💾 Saving to: {file_path}")
-                
-                # 保存视频（不包含音频）
-                imageio.mimsave(file_path, video_frames, fps=fps, codec='libx264')
+                if notes and all('timestamp' in note for note in notes):
+                    # 音符按播放时间对齐到视频时间轴，渲染后与视频合成为一个文件
+                    import tempfile
+                    
+                    start_times = recorder.to_output_time([note['timestamp'] for note in notes])
+                    sample_rate = 44100
+                    audio_data = render_timed_notes(notes, start_times, sample_rate,
+                                                    total_duration=recorder.duration)
+                    fd, audio_path = tempfile.mkstemp(prefix='image2melody_', suffix='.wav')
+                    os.close(fd)
+                    try:
+                        write_wav(audio_path, audio_data, sample_rate)
+                        recorder.save_with_audio(file_path, audio_path)
+                    finally:
+                        os.remove(audio_path)
+                    audio_note = f"Audio: {len(notes)} notes (muxed)"
+                else:
+                    recorder.save_as(file_path)
+                    audio_note = "Audio: none recorded"
                 
                 print(f"✅ Video exported successfully!")
+                print(f"📊 Video: {recorder.frames_written} frames @ {recorder.fps} FPS "
+                      f"({recorder.frames_added} recorded, {recorder.frames_dropped} dropped)")
                 
                 self.show_mac_dialog("Success", 
                     f"Video exported successfully!\n\n"
-                    f"Frames: {len(self.animation_frames)}\n"
-                    f"FPS: {fps}\n"
-                    f"Duration: {len(self.animation_frames)/fps:.2f}s\n"
-                    f"File: {file_path}\n\n"
-                    f"Note: Export audio separately and combine in video editor if needed.",
+                    f"Frames: {recorder.frames_written}\n"
+                    f"FPS: {recorder.fps}\n"
+                    f"Duration: {recorder.duration:.2f}s\n"
+                    f"{audio_note}\n"
+                    f"File: {file_path}",
                     dialog_type="success")
                 
                 self.status_canvas.itemconfig(self.status_text_id,
@@ -2753,7 +2756,13 @@ class Image2MelodyApp:
                 print(f"✗ Video export failed:")
                 traceback.print_exc()
                 self.show_mac_dialog("Error", f"Failed to export video:\n\n{str(e)}\n\nCheck terminal for details.", dialog_type="error")
-
+    
+    def close_animation_recorder(self):
+        """结束并删除上一次动画的视频录制"""
+        if self.animation_recorder is not None:
+            self.animation_recorder.close()
+            self.animation_recorder = None
+        self.animation_frame_count = 0
     
     def export_audio(self):
         """导出音频WAV文件"""
@@ -2772,43 +2781,16 @@ class Image2MelodyApp:
         
         if file_path:
             try:
-                import numpy as np
-                import wave
-                
                 self.status_canvas.itemconfig(self.status_text_id,
                     text="[ EXPORTING ] Rendering audio...")
                 self.root.update()
                 
-                # 生成音频波形
+                # 生成音频波形（一次向量化渲染为16-bit PCM）
                 sample_rate = 44100
-                audio_data = []
-                
-                for note_info in self.melody_generator.recorded_notes:
-                    pitch = note_info['pitch']
-                    duration = note_info['duration']
-                    velocity = note_info['velocity']
-                    
-                    # 生成方波音符
-                    frequency = 440.0 * (2 ** ((pitch - 69) / 12.0))
-                    num_samples = int(duration * sample_rate)
-                    t = np.linspace(0, duration, num_samples, False)
-                    
-                    # 方波生成（8-bit风格）
-                    wave_data = np.sign(np.sin(2 * np.pi * frequency * t))
-                    wave_data *= (velocity / 127.0) * 0.3  # 音量调整
-                    
-                    audio_data.extend(wave_data)
-                
-                # 转换为16-bit PCM
-                audio_data = np.array(audio_data)
-                audio_data = np.int16(audio_data * 32767)
+                audio_data = render_notes(self.melody_generator.recorded_notes, sample_rate)
                 
                 # 保存WAV文件
-                with wave.open(file_path, 'w') as wav_file:
-                    wav_file.setnchannels(1)  # 单声道
-                    wav_file.setsampwidth(2)  # 16-bit
-                    wav_file.setframerate(sample_rate)
-                    wav_file.writeframes(audio_data.tobytes())
+                write_wav(file_path, audio_data, sample_rate)
                 
                 duration_sec = len(audio_data) / sample_rate
                 self.show_mac_dialog("Success", 
@@ -2833,6 +2815,7 @@ class Image2MelodyApp:
         self.current_image = None
         self.pixelated_image = None
         self.melody_generator.clear_recorded_notes()  # 清空录制的音符
+        self.close_animation_recorder()
         self.draw_load_button()
         self.status_canvas.itemconfig(self.status_text_id,
             text="[ READY ] Load image to start")
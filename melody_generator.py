@@ -3,31 +3,108 @@ Melody Generator Module
 将RGB值转换为8-bit风格的音乐旋律
 基于HSV（色相、饱和度、明度）生成音符
 使用pygame.mixer直接生成波形声音（无需MIDI设备）
+音频输出在第一次播放时才初始化（见 audio_engine 的 sink），
+只生成 MIDI/WAV 时不导入 pygame、不打开音频设备
 """
 from midiutil import MIDIFile
-import pygame
 import numpy as np
 import tempfile
 import os
 import colorsys
+import threading
+from collections import OrderedDict
+
+
+# 音符查找表的格式版本（修改映射逻辑时递增，使旧缓存文件失效）
+NOTE_LUT_VERSION = 1
+
+# 查找表中时长按索引存储：0=暗, 1=标准, 2=亮
+NOTE_DURATIONS = np.array([0.0625, 0.125, 0.25])
+NOTE_DURATION_VALUES = tuple(NOTE_DURATIONS.tolist())
+
+
+class SoundCache:
+    """
+    已合成音符波形的LRU缓存
+    键为量化后的 (频率, 时长, 音量)，值为 int16 立体声采样和按需创建的 pygame Sound
+    音符种类很少（约24个音高 × 3种时长 × 若干力度），实时播放时几乎全部命中
+    """
+    def __init__(self, max_entries=1024):
+        """max_entries: 最多缓存的音符数量，超过时淘汰最久未使用的"""
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(frequency, duration, volume):
+        """量化键：频率0.01Hz、时长1ms、音量0.01（听不出差别，但大幅减少条目数）"""
+        return (round(frequency, 2), round(duration, 3), round(volume, 2))
+    
+    def get(self, key, synthesize):
+        """
+        返回键对应的缓存条目 [samples, sound]，未命中时调用 synthesize() 生成采样
+        sound 由调用方在需要时创建并写回（摄像头录音等只需要采样）
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        # 在锁外合成，避免阻塞其他线程的命中
+        entry = [synthesize(), None]
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+    
+    def clear(self):
+        """清空缓存（统计保留）"""
+        with self._lock:
+            self.entries.clear()
+    
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
 
 
 class MelodyGenerator:
-    def __init__(self):
+    def __init__(self, audio_sink='pygame'):
+        """
+        audio_sink: 音频输出，第一次播放时创建并打开（见 audio_engine.make_audio_sink）
+                    'pygame' - 实时播放；'null' - 丢弃；'xxx.wav' - 写入文件；或 sink 对象
+        """
         self.midi_file = None
         self.notes = []
         self.tempo = 160  # BPM - 8-bit风格通常更快
         self.temp_midi_path = None
         self.recorded_notes = []  # 记录所有播放的音符
+        self.note_lut = None  # RGB→音符查找表（enable_note_lut 后可用）
+        self.note_lut_bits = 8
+        self.note_lut_scale = None
+        self.sound_cache = SoundCache()  # 实时播放用的音符波形缓存
         
-        # 初始化pygame mixer用于直接播放波形音频（无需MIDI）
-        try:
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-            self.audio_initialized = True
-            print("✓ Audio initialized successfully")
-        except Exception as e:
-            self.audio_initialized = False
-            print(f"✗ Audio initialization failed: {e}")
+        # 音频输出延迟到第一次播放（ensure_audio）时初始化
+        self.audio_sink = audio_sink
+        self.audio_initialized = False
+        self._audio_opened = False
+        self._audio_lock = threading.Lock()
         
         # 音阶定义 - 8-bit游戏风格的五声音阶
         # 使用C大调五声音阶: C, D, E, G, A
@@ -36,9 +113,9 @@ class MelodyGenerator:
         # 完整音阶用于更复杂的旋律
         self.full_scale = [60, 62, 64, 65, 67, 69, 71, 72]  # C, D, E, F, G, A, B, C (MIDI note numbers)
     
-    def generate_square_wave(self, frequency, duration, volume=0.5):
+    def generate_square_wave_samples(self, frequency, duration, volume=0.5):
         """
-        生成8-bit风格的方波音频（无需MIDI设备）
+        生成8-bit风格方波的 int16 立体声采样 (num_samples, 2)
         frequency: 频率（Hz）
         duration: 持续时间（秒）
         volume: 音量（0.0-1.0）
@@ -61,9 +138,73 @@ class MelodyGenerator:
         wave = (wave * 32767).astype(np.int16)
         
         # 创建立体声
-        stereo_wave = np.column_stack((wave, wave))
+        return np.column_stack((wave, wave))
+    
+    def generate_square_wave(self, frequency, duration, volume=0.5):
+        """
+        生成8-bit风格的方波音频（无需MIDI设备）
+        frequency: 频率（Hz）
+        duration: 持续时间（秒）
+        volume: 音量（0.0-1.0）
+        """
+        import pygame
+        return pygame.sndarray.make_sound(self.generate_square_wave_samples(frequency, duration, volume))
+    
+    def get_cached_samples(self, frequency, duration, volume=0.5):
+        """从缓存获取方波采样（参数先量化，未命中时合成一次）"""
+        frequency, duration, volume = key = SoundCache.make_key(frequency, duration, volume)
+        entry = self.sound_cache.get(
+            key, lambda: self.generate_square_wave_samples(frequency, duration, volume))
+        return entry[0]
+    
+    def get_cached_sound(self, frequency, duration, volume=0.5):
+        """从缓存获取预先构建的 pygame Sound（实时播放路径不再合成波形）"""
+        frequency, duration, volume = key = SoundCache.make_key(frequency, duration, volume)
+        entry = self.sound_cache.get(
+            key, lambda: self.generate_square_wave_samples(frequency, duration, volume))
+        if entry[1] is None:
+            import pygame
+            entry[1] = pygame.sndarray.make_sound(entry[0])
+        return entry[1]
+    
+    def ensure_audio(self):
+        """
+        第一次调用时创建并打开音频输出，之后直接返回结果
+        返回音频是否可用
+        """
+        if self._audio_opened:
+            return self.audio_initialized
         
-        return pygame.sndarray.make_sound(stereo_wave)
+        with self._audio_lock:
+            if not self._audio_opened:
+                from audio_engine import make_audio_sink
+                try:
+                    sink = make_audio_sink(self.audio_sink, sample_rate=22050)
+                    self.audio_initialized = bool(sink.open())
+                    self.audio_sink = sink
+                except Exception as e:
+                    print(f"✗ Audio initialization failed: {e}")
+                self._audio_opened = True
+        return self.audio_initialized
+    
+    @property
+    def audio_engine(self):
+        """实时混音引擎（PygameSink 已打开时），否则为 None"""
+        if not self.audio_initialized:
+            return None
+        return getattr(self.audio_sink, 'engine', None)
+    
+    def plays_sounds(self):
+        """音频输出是否逐个播放 pygame Sound（混音引擎启动失败时），此时复用缓存的 Sound 对象"""
+        return self.audio_initialized and getattr(self.audio_sink, 'plays_sounds', False)
+    
+    def close_audio(self):
+        """关闭音频输出（FileSink 写完文件），之后再播放会重新打开"""
+        with self._audio_lock:
+            if self.audio_initialized:
+                self.audio_sink.close()
+            self.audio_initialized = False
+            self._audio_opened = False
     
     def midi_note_to_frequency(self, midi_note):
         """将MIDI音符号转换为频率（Hz）"""
@@ -76,15 +217,17 @@ class MelodyGenerator:
         duration: 持续时间（秒）
         velocity: 音量（0-127）
         """
-        if not self.audio_initialized:
+        if not self.ensure_audio():
             return
         
         try:
             frequency = self.midi_note_to_frequency(pitch)
             volume = velocity / 127.0 * 0.3  # 限制最大音量为0.3避免过响
             
-            sound = self.generate_square_wave(frequency, duration, volume)
-            sound.play()
+            if self.plays_sounds():
+                self.get_cached_sound(frequency, duration, volume).play()
+            else:
+                self.audio_sink.play(self.get_cached_samples(frequency, duration, volume))
             
         except Exception as e:
             print(f"播放音符失败: {e}")
@@ -142,11 +285,178 @@ class MelodyGenerator:
         
         return pitch, duration, velocity
     
+    def rgba_to_notes_hsv(self, rgba):
+        """
+        rgba_to_note_hsv 的批量版本（NumPy向量化，结果与逐个调用完全一致）
+        rgba: (N, 4) 或 (N, 3) 的 uint8 数组（或可转换为数组的列表），没有alpha时视为255
+        
+        返回: (pitch, duration, velocity) 三个长度为N的数组
+        """
+        rgba = np.asarray(rgba).reshape(-1, np.shape(rgba)[-1])
+        r, g, b = (rgba[:, i] / 255.0 for i in range(3))
+        if rgba.shape[1] > 3:
+            a = rgba[:, 3].astype(np.float64)
+        else:
+            a = np.full(len(rgba), 255.0)
+        
+        # 与 colorsys.rgb_to_hsv 相同的浮点运算顺序
+        maxc = np.maximum(np.maximum(r, g), b)
+        minc = np.minimum(np.minimum(r, g), b)
+        rangec = maxc - minc
+        v = maxc
+        gray = rangec == 0
+        safe_range = np.where(gray, 1.0, rangec)
+        s = np.where(gray, 0.0, rangec / np.where(gray, 1.0, maxc))
+        rc = (maxc - r) / safe_range
+        gc = (maxc - g) / safe_range
+        bc = (maxc - b) / safe_range
+        h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = np.where(gray, 0.0, np.mod(h / 6.0, 1.0))
+        
+        # 色相 → 五声音阶，明度 → 八度偏移和时长
+        scale = np.array(self.pentatonic_scale)
+        scale_len = len(scale)
+        base_pitch = scale[(h * scale_len).astype(np.int64) % scale_len]
+        bright = v > 0.7
+        normal = v > 0.4
+        octave_shift = np.where(bright, 12, np.where(normal, 0, -12))
+        pitch = np.clip(base_pitch + octave_shift, 36, 96)
+        duration = np.where(bright, 0.25, np.where(normal, 0.125, 0.0625))
+        
+        # 饱和度 + Alpha → 力度（两次int截断与标量版本一致）
+        saturation_velocity = (50 + s * 60).astype(np.int64)
+        velocity = (saturation_velocity * (a / 255.0)).astype(np.int64)
+        velocity = np.clip(velocity, 40, 127)
+        
+        return pitch, duration, velocity
+    
+    def note_lut_path(self, bits=8, cache_dir=None):
+        """查找表缓存文件路径（文件名包含版本、量化位数和当前音阶）"""
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'image2melody')
+        scale = '-'.join(str(note) for note in self.pentatonic_scale)
+        return os.path.join(cache_dir, f"note_lut_v{NOTE_LUT_VERSION}_{bits}bit_{scale}.npy")
+    
+    def build_note_lut(self, bits=8, out=None, chunk_size=1 << 20):
+        """
+        计算RGB→音符查找表
+        bits: 每通道位数（8 = 完整24位，5/6 = 量化，每个区间取中心颜色计算）
+        out: 可选的预分配 (2**(3*bits), 3) uint8 数组（例如写入缓存文件的memmap）
+        
+        每行是 (pitch, 时长索引, 饱和度力度)，alpha 在查表时单独应用
+        分块计算，避免一次性生成上千万个浮点中间值
+        """
+        size = 1 << (3 * bits)
+        if out is None:
+            out = np.empty((size, 3), dtype=np.uint8)
+        
+        shift = 8 - bits
+        center = (1 << shift) >> 1
+        mask = (1 << bits) - 1
+        for start in range(0, size, chunk_size):
+            index = np.arange(start, min(start + chunk_size, size))
+            rgb = np.stack([
+                ((index >> (2 * bits)) & mask) << shift,
+                ((index >> bits) & mask) << shift,
+                (index & mask) << shift,
+            ], axis=1) + center
+            # alpha=255 时力度就是未截断的饱和度力度（50-110）
+            pitch, duration, velocity = self.rgba_to_notes_hsv(rgb)
+            
+            out[start:start + len(index), 0] = pitch
+            out[start:start + len(index), 1] = np.searchsorted(NOTE_DURATIONS, duration)
+            out[start:start + len(index), 2] = velocity
+        return out
+    
+    def enable_note_lut(self, bits=8, cache_dir=None):
+        """
+        启用RGB→音符查找表
+        优先以 mmap 方式打开缓存文件（后续进程几乎立即可用）；
+        没有缓存时分块计算并原子写入缓存（写入失败时只保存在内存中）
+        bits: 每通道位数，8 为精确结果，5 或 6 为量化（表更小、构建更快）
+        """
+        if not 1 <= bits <= 8:
+            raise ValueError(f"bits must be between 1 and 8, got {bits}")
+        
+        scale = tuple(self.pentatonic_scale)
+        path = self.note_lut_path(bits, cache_dir)
+        lut = None
+        
+        if os.path.exists(path):
+            try:
+                lut = np.load(path, mmap_mode='r')
+                if lut.shape != (1 << (3 * bits), 3) or lut.dtype != np.uint8:
+                    lut = None
+            except Exception as e:
+                print(f"⚠ Note lookup table cache unreadable: {e}")
+                lut = None
+        
+        if lut is None:
+            print(f"Building {bits}-bit note lookup table...")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                                shape=(1 << (3 * bits), 3))
+                self.build_note_lut(bits, out=out)
+                out.flush()
+                del out
+                os.replace(tmp_path, path)
+                lut = np.load(path, mmap_mode='r')
+                print(f"✓ Note lookup table cached: {path}")
+            except OSError as e:
+                print(f"⚠ Could not cache note lookup table: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                lut = self.build_note_lut(bits)
+        
+        self.note_lut_bits = bits
+        self.note_lut_scale = scale
+        # 去掉 np.memmap 子类（仍共享映射的内存），单个音符查表时索引开销小得多
+        self.note_lut = np.asarray(lut)
+        return self.note_lut
+    
+    def lookup_notes(self, rgba):
+        """
+        批量RGBA→音符：启用了查找表时只做一次索引，否则回退到 rgba_to_notes_hsv
+        rgba: (N, 4) 或 (N, 3) 的 uint8 数组
+        
+        返回: (pitch, duration, velocity) 三个长度为N的数组
+        """
+        lut = self.note_lut
+        if lut is None or self.note_lut_scale != tuple(self.pentatonic_scale):
+            return self.rgba_to_notes_hsv(rgba)
+        
+        rgba = np.asarray(rgba).reshape(-1, np.shape(rgba)[-1])
+        bits = self.note_lut_bits
+        shift = 8 - bits
+        rgb = rgba[:, :3].astype(np.intp) >> shift
+        notes = lut[(rgb[:, 0] << (2 * bits)) | (rgb[:, 1] << bits) | rgb[:, 2]]
+        
+        pitch = notes[:, 0].astype(np.int64)
+        duration = NOTE_DURATIONS[notes[:, 1]]
+        velocity = notes[:, 2].astype(np.int64)
+        if rgba.shape[1] > 3:
+            velocity = (velocity * (rgba[:, 3] / 255.0)).astype(np.int64)
+        velocity = np.clip(velocity, 40, 127)
+        
+        return pitch, duration, velocity
+    
     def rgba_to_note(self, r, g, b, a=255):
         """
         将RGBA值转换为8-bit风格的音符参数（使用HSV）
+        启用查找表后直接用Python整数索引查表（不构造数组，批量转换用 lookup_notes）
         """
-        return self.rgba_to_note_hsv(r, g, b, a)
+        lut = self.note_lut
+        if lut is None or self.note_lut_scale != tuple(self.pentatonic_scale):
+            return self.rgba_to_note_hsv(r, g, b, a)
+        
+        bits = self.note_lut_bits
+        shift = 8 - bits
+        index = ((int(r) >> shift) << (2 * bits)) | ((int(g) >> shift) << bits) | (int(b) >> shift)
+        pitch, duration_index, velocity = lut[index].tolist()
+        velocity = int(velocity * (a / 255.0))
+        return pitch, NOTE_DURATION_VALUES[duration_index], max(40, min(127, velocity))
     
     def rgb_to_note(self, r, g, b):
         """
@@ -184,15 +494,20 @@ class MelodyGenerator:
         self.notes = []
         current_time = 0
         
-        # 生成音符
-        for i, (r, g, b) in enumerate(sampled_rgb):
-            pitch, duration, velocity = self.rgb_to_note(r, g, b)
-            
+        # 生成音符（批量计算音符参数，只使用RGB通道；rgb_data 可为3元组或4元组）
+        if len(sampled_rgb):
+            rgb = np.asarray(sampled_rgb, dtype=np.uint8).reshape(len(sampled_rgb), -1)[:, :3]
+        else:
+            rgb = np.empty((0, 3), dtype=np.uint8)
+        pitches, durations, velocities = self.lookup_notes(rgb)
+        
+        for i, (rgb_value, pitch, duration, velocity) in enumerate(zip(
+                rgb.tolist(), pitches.tolist(), durations.tolist(), velocities.tolist())):
             self.midi_file.addNote(track, channel, pitch, current_time, duration, velocity)
             
             self.notes.append({
                 'index': i + 1,
-                'rgb': (r, g, b),
+                'rgb': tuple(rgb_value),
                 'pitch': pitch,
                 'duration': duration,
                 'velocity': velocity,
@@ -269,7 +584,9 @@ class MelodyGenerator:
             self.temp_midi_path = temp_file.name
             self.midi_file.writeFile(temp_file)
         
-        # 播放MIDI文件
+        # 播放MIDI文件（需要 pygame mixer）
+        self.ensure_audio()
+        import pygame
         try:
             pygame.mixer.music.load(self.temp_midi_path)
             pygame.mixer.music.play()
@@ -343,6 +660,11 @@ class MelodyGenerator:
         """清空录制的音符"""
         self.recorded_notes = []
     
+    def stop_all_sounds(self):
+        """立即停止所有正在播放的声音（音频尚未初始化时什么也不做）"""
+        if self.audio_initialized:
+            self.audio_sink.stop_all()
+    
     def __del__(self):
         """清理资源"""
         if self.temp_midi_path and os.path.exists(self.temp_midi_path):
@@ -354,23 +676,21 @@ class MelodyGenerator:
     def generate_chord_from_column(self, column_pixels, octave_shift=0):
         """
         从一列像素生成和弦
-        column_pixels: list of (r, g, b, a) 元组
+        column_pixels: list of (r, g, b, a) 元组，或 (N, 4) 数组
         octave_shift: 音高偏移（半音）
         
         返回: list of (pitch, velocity, duration) 元组
         """
-        chord_notes = []
+        if len(column_pixels) == 0:
+            return []
         
-        for r, g, b, a in column_pixels:
-            # 使用HSV转换获取音符
-            pitch, velocity, duration = self.rgba_to_note_hsv(r, g, b, a)
-            
-            # 应用音高偏移
-            adjusted_pitch = max(0, min(127, pitch + octave_shift))
-            
-            chord_notes.append((adjusted_pitch, velocity, duration))
+        # 使用HSV转换批量获取音符
+        pitches, durations, velocities = self.lookup_notes(column_pixels)
         
-        return chord_notes
+        # 应用音高偏移
+        pitches = np.clip(pitches + octave_shift, 0, 127)
+        
+        return list(zip(pitches.tolist(), velocities.tolist(), durations.tolist()))
     
     def play_chord_direct(self, chord_notes, max_duration):
         """
@@ -378,10 +698,11 @@ class MelodyGenerator:
         chord_notes: list of (pitch, velocity, duration) 元组
         max_duration: 和弦的最大持续时间（秒）
         """
-        if not self.audio_initialized:
+        if not self.ensure_audio():
             return
         
         sounds = []
+        plays_sounds = self.plays_sounds()
         
         try:
             # 为和弦中的每个音符生成声音
@@ -390,12 +711,17 @@ class MelodyGenerator:
                 volume = velocity / 127.0 * 0.2  # 降低音量避免和弦过响
                 note_duration = min(duration / 4.0, max_duration)  # 使用较短的时长
                 
-                sound = self.generate_square_wave(frequency, note_duration, volume)
-                sounds.append(sound)
+                if plays_sounds:
+                    sounds.append(self.get_cached_sound(frequency, note_duration, volume))
+                else:
+                    sounds.append(self.get_cached_samples(frequency, note_duration, volume))
             
-            # 同时播放所有音符
+            # 同时播放所有音符（混音引擎在同一块中开始所有声部）
             for sound in sounds:
-                sound.play()
+                if plays_sounds:
+                    sound.play()
+                else:
+                    self.audio_sink.play(sound)
                 
         except Exception as e:
             print(f"播放和弦失败: {e}")
@@ -403,8 +729,8 @@ class MelodyGenerator:
     def generate_melody_from_columns(self, columns_data, octave_shift=0):
         """
         从列数据生成旋律
-        columns_data: list of list of (r, g, b, a)
-        每个子列表代表一列的所有像素
+        columns_data: list of list of (r, g, b, a)，每个子列表代表一列的所有像素；
+                      也可以是 (H, W, 4) 的网格数组（每个 x 为一列，从上到下）
         
         返回: MIDI文件和音符信息
         """
@@ -418,6 +744,9 @@ class MelodyGenerator:
         self.notes = []
         current_time = 0
         
+        if isinstance(columns_data, np.ndarray):
+            columns_data = columns_data.transpose(1, 0, 2)
+        
         # 遍历每一列（从左到右）
         for col_index, column_pixels in enumerate(columns_data):
             # 为这一列生成和弦
@@ -427,6 +756,9 @@ class MelodyGenerator:
             avg_duration = sum(d for _, _, d in chord_notes) / len(chord_notes) if chord_notes else 0.5
             chord_duration = min(1.0, max(0.25, avg_duration))
             
+            # 使用列的第一个像素颜色作为代表
+            rgb = tuple(int(c) for c in column_pixels[0][:3]) if len(column_pixels) else (0, 0, 0)
+            
             # 将和弦中的所有音符添加到MIDI文件（同一时间开始）
             for pitch, velocity, duration in chord_notes:
                 self.midi_file.addNote(track, channel, pitch, current_time, chord_duration, velocity)
@@ -439,7 +771,7 @@ class MelodyGenerator:
                     'velocity': velocity,
                     'duration': chord_duration,
                     'time': current_time,
-                    'rgb': column_pixels[0][:3] if column_pixels else (0, 0, 0)  # 使用列的第一个像素颜色作为代表
+                    'rgb': rgb
                 })
             
             # 移动到下一列的时间
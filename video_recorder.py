@@ -0,0 +1,238 @@
+"""
+Video Recorder Module
+录制时直接把帧送入 imageio-ffmpeg 编码器（后台线程），不在内存中保存帧列表
+根据帧的时间戳把不规则的帧间隔转换为固定帧率：间隔长时重复帧，间隔短时丢帧
+"""
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+
+
+class VideoRecorder:
+    def __init__(self, fps=30, codec='libx264', quality=8, max_queue=32, max_gap=0.5):
+        """
+        fps: 输出的固定帧率
+        codec: ffmpeg 编码器
+        quality: imageio 的质量参数（0-10）
+        max_queue: 等待编码的帧数上限（满时 add_frame 丢弃新帧或等待，保证内存不增长）
+        max_gap: 超过这个间隔（秒）的停顿（例如暂停）只按一帧计算
+        """
+        self.fps = fps
+        self.codec = codec
+        self.quality = quality
+        self.max_gap = max_gap
+        
+        fd, self.path = tempfile.mkstemp(prefix='image2melody_', suffix='.mp4')
+        os.close(fd)
+        
+        self.frame_size = None
+        self.frames_added = 0      # 收到的帧
+        self.frames_written = 0    # 写入编码器的帧（含重复帧）
+        self.frames_dropped = 0    # 因间隔过短或编码跟不上（队列已满）丢弃的帧
+        self.frame_times = []      # 每个收到的帧在输出视频中的时间（秒），用于对齐音频
+        self.capture_times = []    # 每个收到的帧的采集时间戳（没有时间戳时为 None）
+        self.error = None
+        
+        self._clock = 0.0           # 输出视频时间轴上的当前时间
+        self._last_timestamp = None
+        self._frames = queue.Queue(maxsize=max_queue)
+        self._drop_lock = threading.Lock()  # frames_dropped 由两个线程累加
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def add_frame(self, frame, timestamp=None, release=None, block=False):
+        """
+        添加一帧
+        frame: PIL Image 或 (H, W, 3/4) uint8 数组（会被复制，调用方之后可以继续修改）
+        timestamp: 帧的采集时间（秒，任意起点），None 时按固定帧率逐帧写入
+        release: 可选的归还回调。给出时数组帧不复制，直接交给编码线程（调用方不能再修改它），
+                 编码线程用完后调用 release(frame) 归还（例如放回缓冲池）
+        block: 编码队列已满时等待（离线导出用）；默认丢弃这一帧并返回 False，
+               不阻塞调用线程（界面线程）
+        """
+        if self._finished or self.error is not None:
+            if release is not None:
+                release(frame)
+            return False
+        
+        source = frame
+        if release is not None and not isinstance(frame, Image.Image) and (
+                self.frame_size is None or frame.shape[1::-1] == self.frame_size):
+            # 零拷贝：数组本身进入编码队列
+            array = frame
+            self.frame_size = array.shape[1::-1]
+        elif isinstance(frame, Image.Image):
+            if frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            if self.frame_size is not None and frame.size != self.frame_size:
+                frame = frame.resize(self.frame_size, Image.Resampling.NEAREST)
+            self.frame_size = frame.size
+            array = np.array(frame)
+        else:
+            array = np.array(frame[..., :3], dtype=np.uint8)
+            if self.frame_size is not None and array.shape[1::-1] != self.frame_size:
+                array = np.array(Image.fromarray(array).resize(self.frame_size, Image.Resampling.NEAREST))
+            self.frame_size = array.shape[1::-1]
+        if release is not None and array is not source:
+            # 已经复制（尺寸不一致或为 PIL Image），原帧可以立即归还
+            release(source)
+            release = None
+        
+        # 输出时间轴：长停顿（例如暂停）压缩为一帧间隔
+        if self.frames_added:
+            gap = None
+            if timestamp is not None and self._last_timestamp is not None:
+                gap = timestamp - self._last_timestamp
+            if gap is not None and 0 <= gap <= self.max_gap:
+                self._clock += gap
+            else:
+                self._clock += 1.0 / self.fps
+        self._last_timestamp = timestamp
+        
+        try:
+            self._frames.put((array, self._clock, release), block=block)
+        except queue.Full:
+            # 编码跟不上：丢弃这一帧，时间轴照常前进（下一帧按时间戳补上间隔）
+            self._count_dropped()
+            if release is not None:
+                release(array)
+            return False
+        
+        self.frame_times.append(self._clock)
+        self.capture_times.append(timestamp)
+        self.frames_added += 1
+        return True
+    
+    def _count_dropped(self):
+        """丢帧计数加一"""
+        with self._drop_lock:
+            self.frames_dropped += 1
+    
+    @property
+    def duration(self):
+        """输出视频的时长（秒）"""
+        return self.frames_written / self.fps
+    
+    def to_output_time(self, timestamps):
+        """
+        把采集时钟上的时间戳（例如音符的播放时间）换算到输出视频的时间轴
+        时间戳落在两帧之间时按与前一帧的间隔偏移，最多偏移到下一帧，
+        因此被压缩的停顿中的事件也对齐到停顿之后的画面
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not self.frame_times or None in self.capture_times:
+            return np.zeros(len(timestamps))
+        
+        capture = np.asarray(self.capture_times, dtype=np.float64)
+        output = np.asarray(self.frame_times, dtype=np.float64)
+        span = np.diff(output, append=output[-1] + 1.0 / self.fps)
+        
+        frame = np.clip(np.searchsorted(capture, timestamps, side='right') - 1, 0, len(capture) - 1)
+        offset = np.clip(timestamps - capture[frame], 0, span[frame])
+        return output[frame] + offset
+    
+    def finish(self):
+        """等待剩余帧编码完成并关闭编码器，返回临时视频路径（可重复调用）"""
+        if not self._finished:
+            self._finished = True
+            self._frames.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.path
+    
+    def save_as(self, file_path):
+        """结束录制并把视频复制到目标路径"""
+        shutil.copyfile(self.finish(), file_path)
+        return file_path
+    
+    def save_with_audio(self, file_path, audio_path):
+        """结束录制，把视频和WAV音频合成为一个文件（视频流直接复制，不重新编码）"""
+        mux_audio(self.finish(), audio_path, file_path)
+        return file_path
+    
+    def close(self):
+        """结束录制并删除临时文件"""
+        try:
+            self.finish()
+        except Exception:
+            pass
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.path = None
+    
+    def _run(self):
+        """编码线程：按时间戳补帧/丢帧，转换为固定帧率写入"""
+        writer = None
+        try:
+            import imageio
+            
+            while True:
+                item = self._frames.get()
+                if item is None:
+                    break
+                array, frame_time, release = item
+                
+                try:
+                    if writer is None:
+                        writer = imageio.get_writer(self.path, fps=self.fps, codec=self.codec,
+                                                    quality=self.quality)
+                    
+                    # 这一帧应覆盖到的输出帧序号
+                    target = int(round(frame_time * self.fps))
+                    if target < self.frames_written:
+                        self._count_dropped()
+                        continue
+                    while self.frames_written <= target:
+                        writer.append_data(array[..., :3])
+                        self.frames_written += 1
+                finally:
+                    if release is not None:
+                        release(array)
+        except Exception as e:
+            self.error = e
+            print(f"✗ Video recorder error: {e}")
+            # 继续取出剩余帧直到结束标记，避免 add_frame 阻塞
+            while True:
+                item = self._frames.get()
+                if item is None:
+                    break
+                if item[2] is not None:
+                    item[2](item[0])
+        finally:
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+
+
+def mux_audio(video_path, audio_path, output_path):
+    """
+    使用 imageio-ffmpeg 自带的 ffmpeg 把音频合入视频
+    视频流直接复制，音频编码为 AAC（音频应与视频等长，见 VideoRecorder.duration）
+    """
+    import imageio_ffmpeg
+    
+    command = [
+        imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+        '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
+        output_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg mux failed: {result.stderr.strip()}")
+    return output_path
+